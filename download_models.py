@@ -1,18 +1,71 @@
 #!/usr/bin/env python3
 """
 下载embedding模型和cross-encoder模型到本地路径
-使用清华镜像源加速下载
+默认使用 hf-mirror.com 镜像源加速下载（可通过 HF_ENDPOINT 环境变量覆盖），
+安装 hf_transfer（pip install hf_transfer）后自动启用并行分片下载
 """
 
+import importlib.util
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+
+# 必须在导入 huggingface_hub / transformers 之前设置，才能生效
+os.environ.setdefault("HF_ENDPOINT", "https://hf-mirror.com")
+if importlib.util.find_spec("hf_transfer") is not None:
+    # 安装了 hf_transfer 时启用多连接并行下载
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+
+from huggingface_hub import snapshot_download
 from sentence_transformers import SentenceTransformer
 from transformers import AutoTokenizer, AutoModel
 
 # 添加项目路径以导入配置
 sys.path.append(str(Path(__file__).resolve().parent))
 from src.config import settings
+from src.recommender.lightweight_models import lightweight_embeddings_model_path
+
+# 只下载 sentence-transformers / transformers 实际加载的文件：配置、分词器、池化层与 safetensors 权重，
+# 跳过仓库中的 onnx/openvino 导出、tf_model.h5、与 safetensors 重复的 pytorch_model.bin 等
+MODEL_ALLOW_PATTERNS = [
+    "*.json",
+    "*.txt",
+    "tokenizer*",
+    "sentencepiece.bpe.model",
+    "modules.json",
+    "1_Pooling/*",
+    "*.safetensors",
+]
+
+
+def _snapshot_model(model_name: str, model_path: Path, extra_patterns: list[str] | None = None):
+    """按 MODEL_ALLOW_PATTERNS 下载模型；仓库没有 safetensors 权重时退回下载 pytorch_model.bin"""
+    snapshot_download(
+        model_name,
+        local_dir=str(model_path),
+        allow_patterns=MODEL_ALLOW_PATTERNS + (extra_patterns or []),
+        max_workers=8,
+    )
+    if not any(model_path.rglob("*.safetensors")):
+        snapshot_download(
+            model_name,
+            local_dir=str(model_path),
+            allow_patterns=["pytorch_model.bin"],
+            max_workers=8,
+        )
+
+
+def _lightweight_extra_patterns() -> list[str] | None:
+    """轻量 embedding 模型走 ONNX 后端时才需要 onnx 导出；指定了量化文件时只下载该文件"""
+    if settings.LIGHTWEIGHT_EMBEDDINGS_BACKEND != "onnx":
+        return None
+    return [settings.LIGHTWEIGHT_EMBEDDINGS_ONNX_FILE or "onnx/*"]
+
+
+def _shares_embedding_snapshot() -> bool:
+    return Path(lightweight_embeddings_model_path()) == Path(settings.EMBEDDINGS_MODEL_PATH)
+
 
 def download_embedding_model():
     """下载embedding模型到本地"""
@@ -30,11 +83,10 @@ def download_embedding_model():
     os.makedirs(model_path, exist_ok=True)
     
     try:
-        # 下载模型
-        model = SentenceTransformer(model_name)
-        
-        # 保存到本地
-        model.save(str(model_path))
+        # 直接下载模型文件到本地目录（支持断点续传，避免先加载再保存）
+        # 轻量模型与主模型是同一仓库时共用此目录，其 ONNX 导出一并下载
+        extra_patterns = _lightweight_extra_patterns() if _shares_embedding_snapshot() else None
+        _snapshot_model(model_name, model_path, extra_patterns)
         
         print(f"Embedding模型下载完成！保存在: {model_path}")
         
@@ -47,6 +99,28 @@ def download_embedding_model():
         print(f"Embedding模型下载失败: {e}")
         raise
 
+def download_lightweight_embedding_model():
+    """下载 get_lightweight_embeddings 实际加载的轻量embedding模型到本地"""
+
+    if _shares_embedding_snapshot():
+        print("轻量embedding模型与embedding模型相同，复用其本地目录")
+        return
+
+    model_name = settings.LIGHTWEIGHT_EMBEDDINGS_MODEL
+    model_path = Path(lightweight_embeddings_model_path())
+
+    print(f"开始下载轻量embedding模型: {model_name}")
+    print(f"保存路径: {model_path}")
+
+    os.makedirs(model_path, exist_ok=True)
+
+    try:
+        _snapshot_model(model_name, model_path, _lightweight_extra_patterns())
+        print(f"轻量embedding模型下载完成！保存在: {model_path}")
+    except Exception as e:
+        print(f"轻量embedding模型下载失败: {e}")
+        raise
+
 def download_cross_encoder_model():
     """下载cross-encoder模型到本地"""
     
@@ -63,13 +137,8 @@ def download_cross_encoder_model():
     os.makedirs(model_path, exist_ok=True)
     
     try:
-        # 下载模型和tokenizer
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
-        model = AutoModel.from_pretrained(model_name)
-        
-        # 保存到本地
-        tokenizer.save_pretrained(str(model_path))
-        model.save_pretrained(str(model_path))
+        # 直接下载模型和tokenizer文件到本地目录
+        _snapshot_model(model_name, model_path)
         
         print(f"Cross-encoder模型下载完成！保存在: {model_path}")
         
@@ -83,16 +152,19 @@ def download_cross_encoder_model():
         raise
 
 def download_all_models():
-    """下载所有模型"""
+    """并行下载所有模型（各下载互不依赖，均为网络 I/O 密集型）"""
     print("开始下载所有模型...")
     print("=" * 60)
     
-    # 下载embedding模型
-    download_embedding_model()
-    print("-" * 50)
-    
-    # 下载cross-encoder模型
-    download_cross_encoder_model()
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [
+            executor.submit(download_embedding_model),
+            executor.submit(download_lightweight_embedding_model),
+            executor.submit(download_cross_encoder_model),
+        ]
+        # result() 会重新抛出下载线程中的异常
+        for future in futures:
+            future.result()
     print("-" * 50)
     
     print("所有模型下载完成！")
@@ -1,25 +1,17 @@
 import pandas as pd
-import re
 input_path = ".\合并结果.xlsx"
 output_path = ".\processed_data.csv"
 
 df = pd.read_excel(input_path)
 
-def clean(text):
-    if not isinstance(text, str):
-        return text
-    text = text.replace("nan", "")
-    text = re.sub(r"\s+", " ", text).strip()
-    return text
-
-df["Product Details"] = df["Product Details"].apply(clean)
+# 向量化清洗：先统一转为 string dtype（数字等非字符串单元格转成文本，空值保持 <NA>，
+# 全空列也不会因 float64 无法使用 .str 而报错），再去掉 "nan" 文本、合并连续空白并去除首尾空白
+df["Product Details"] = (
+    df["Product Details"]
+    .astype("string")
+    .str.replace("nan", "", regex=False)
+    .str.replace(r"\s+", " ", regex=True)
+    .str.strip()
+)
 
 df.to_csv(output_path, index=False)
-
-
-
-
-
-
-
-
@@ -1,8 +1,28 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
 from src.api.routers import recommender
+from src.config import settings
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Load retriever and chatbot chain at startup.
+    """
+    # 在线程中构建推荐图，加载模型期间不阻塞事件循环
+    await asyncio.to_thread(recommender.get_graph_app)
+    if settings.ENABLE_WARMUP:
+        from src.recommender.graph import warmup
+
+        await asyncio.to_thread(warmup)
+    yield
 
-app = FastAPI(title="LLM Recommender API", version="1.0")
+
+app = FastAPI(title="LLM Recommender API", version="1.0", lifespan=lifespan)
 
 # Include API routers
 app.include_router(recommender.router)
@@ -17,3 +37,20 @@ def root():
 @app.get("/health")
 def health():
     return {"status": "healthy"}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # 每个 worker 都会独立加载一份推荐图（检索器、cross-encoder 等模型），
+    # 内存占用约为 单进程 × WEB_CONCURRENCY；默认单 worker。
+    # loop/http 为 "auto" 时，若安装了 uvloop / httptools（uvicorn[standard]）会自动启用。
+    uvicorn.run(
+        "src.api.main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        loop="auto",
+        http="auto",
+        timeout_keep_alive=30,
+    )
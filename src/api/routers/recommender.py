@@ -3,29 +3,30 @@ Chatbot API Router.
 """
 
 import warnings
+from functools import lru_cache
+from operator import attrgetter
 
+import orjson
 from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from loguru import logger
 from pydantic import BaseModel
 
 warnings.filterwarnings("ignore")
 
 from src.recommender.graph import create_recommendaer_graph
+from src.recommender.state import initial_state
 
-router = APIRouter(prefix="/recommend", tags=["Recommender"])
+router = APIRouter(
+    prefix="/recommend", tags=["Recommender"], default_response_class=ORJSONResponse
+)
 
-# create graph app at startup
-graph_app = None
-
-
-@router.on_event("startup")
-async def startup_event():
+@lru_cache(maxsize=1)
+def get_graph_app():
     """
-    Load retriever and chatbot chain at startup.
+    Build the recommender graph (retrievers, LLM, cross-encoder) once per process.
     """
-    global graph_app
-    graph_app = create_recommendaer_graph()
+    return create_recommendaer_graph()
 
 
 class QuestionRequest(BaseModel):
@@ -36,32 +37,79 @@ class QuestionRequest(BaseModel):
     question: str
 
 
+_get_doc_id = attrgetter("id")
+
+
 @router.post("/", response_model=dict)
-def get_chat_response(request: QuestionRequest):
+async def get_chat_response(request: QuestionRequest):
     """
     Get a recommendation to a query from the chatbot.
     """
     try:
-        initial_state = {
-            "query": request.question,
-            "on_topic": False,  # 默认值，会被check_topic节点更新
-            "recommendation": "",  # 默认空字符串
-            "self_query_state": "",  # 默认空字符串
-            "docs": [],  # 默认空列表
-            "ranker_attempted": False,  # 默认False，表示还没有尝试过ranker
-        }
-        
-        response = graph_app.invoke(initial_state)
-        recommendation = response.get(
+        state = initial_state(request.question)
+
+        # 异步执行图，LLM 等待期间不占用事件循环/线程池
+        response = await get_graph_app().ainvoke(state)
+        response_get = response.get
+        recommendation = response_get(
             "recommendation", "No recommendation found for your request."
         )
-        docs = response.get("docs", [])
-        indexes = [doc.id for doc in docs]
+        indexes = list(map(_get_doc_id, response_get("docs") or ()))
         content = {"question": request.question, "answer": recommendation, "indexes": indexes}
         logger.info(content)
-        return JSONResponse(
-            content=content,
-        )
+        return content
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+# 只转发生成最终回复的节点的 token，分类 / self-query 的 LLM 输出不对用户展示
+_STREAMED_NODES = frozenset({"rag_recommender", "not_fashion_llm_response"})
+
+
+def _sse(payload: dict) -> bytes:
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+@router.post("/stream")
+async def stream_chat_response(request: QuestionRequest):
+    """
+    Stream a recommendation as Server-Sent Events.
+
+    Emits `{"token": ...}` events while the answer is generated, then a final
+    `{"done": true, "question", "answer", "indexes"}` event.
+    """
+    state = initial_state(request.question)
+
+    async def event_stream():
+        streamed = False
+        final_state = None
+        try:
+            async for event in get_graph_app().astream_events(state, version="v2"):
+                kind = event["event"]
+                if kind == "on_chat_model_stream":
+                    if event.get("metadata", {}).get("langgraph_node") in _STREAMED_NODES:
+                        token = event["data"]["chunk"].content
+                        if token:
+                            streamed = True
+                            yield _sse({"token": token})
+                elif kind == "on_chain_end" and not event.get("parent_ids"):
+                    final_state = event["data"].get("output")
+        except Exception as e:
+            logger.exception("Error while streaming recommendation")
+            yield _sse({"error": f"Error: {str(e)}"})
+            return
+
+        final_state = final_state if isinstance(final_state, dict) else {}
+        recommendation = final_state.get(
+            "recommendation", "No recommendation found for your request."
+        )
+        # 命中缓存等未产生 token 流的情况，一次性发送完整回复
+        if not streamed:
+            yield _sse({"token": recommendation})
+        indexes = list(map(_get_doc_id, final_state.get("docs") or ()))
+        yield _sse(
+            {"done": True, "question": request.question, "answer": recommendation, "indexes": indexes}
+        )
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
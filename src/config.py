@@ -1,16 +1,19 @@
 """Configuration settings for the project."""
 
 import os
+from functools import lru_cache
 from pathlib import Path
 
 from dotenv import load_dotenv
-from pydantic import SecretStr
+from pydantic import Field, SecretStr
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 # 获取项目根目录
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 # 加载.env文件，使用绝对路径确保能找到文件
+# Settings 字段由 BaseSettings 自行解析 env_file；这里仅为 kaggle、LangSmith 等
+# 直接读取 os.environ 的第三方库导出变量
 load_dotenv(BASE_DIR / ".env")
 
 
@@ -33,14 +36,16 @@ class Settings(BaseSettings):
     PROCESSED_DATA_PATH: str = str(DATA_DIR / "processed_data.json")
 
     # Kaggle settings
-    KAGGLE_USERNAME: str = os.environ.get("KAGGLE_USERNAME", "")
-    KAGGLE_KEY: SecretStr = SecretStr(os.environ.get("KAGGLE_KEY", ""))
+    KAGGLE_USERNAME: str = Field(default="")
+    KAGGLE_KEY: SecretStr = Field(default=SecretStr(""))
 
     # Embeddings settings
     # EMBEDDINGS_MODEL_NAME: str = "BAAI/llm-embedder"
     # EMBEDDINGS_MODEL_NAME: str = "sentence-transformers/all-MiniLM-L6-v2"
     EMBEDDINGS_MODEL_NAME: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
     EMBEDDINGS_MODEL_PATH: str = str(BASE_DIR / "models" / "embeddings")
+    EMBEDDINGS_BATCH_SIZE: int = 64
+    EMBEDDINGS_DEVICE: str = "auto"  # auto, cpu, cuda, cuda:0 ...
     # CROSS_ENCODER_MODEL_NAME: str = "BAAI/bge-reranker-base"
     CROSS_ENCODER_MODEL_NAME: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
     CROSS_ENCODER_MODEL_PATH: str = str(BASE_DIR / "models" / "cross-encoder")
@@ -48,6 +53,13 @@ class Settings(BaseSettings):
     # Lightweight model settings for server deployment
     USE_LIGHTWEIGHT_MODELS: bool = False
     LIGHTWEIGHT_EMBEDDINGS_MODEL: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+    # download_models.py 下载到的本地快照；与 EMBEDDINGS_MODEL_NAME 相同时直接复用 EMBEDDINGS_MODEL_PATH
+    LIGHTWEIGHT_EMBEDDINGS_MODEL_PATH: str = str(BASE_DIR / "models" / "lightweight-embeddings")
+    # torch 或 onnx；onnx 需安装 optimum[onnxruntime]，模型无 ONNX 文件时会自动导出
+    LIGHTWEIGHT_EMBEDDINGS_BACKEND: str = "torch"
+    # 可选：量化后的 ONNX 文件（相对模型目录），如 "onnx/model_qint8_avx512_vnni.onnx"
+    LIGHTWEIGHT_EMBEDDINGS_ONNX_FILE: str = ""
+    LIGHTWEIGHT_EMBEDDINGS_BATCH_SIZE: int = 32
     LIGHTWEIGHT_CROSS_ENCODER: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
     LIGHTWEIGHT_LLM: str = "llama3.2:1b"  # 更小的模型
     
@@ -57,19 +69,38 @@ class Settings(BaseSettings):
     MIN_SAMPLE_SIZE: int = 50       # 最小样本数
 
     # LLM settings - OpenRouter Configuration
-    LLM_MODEL_NAME: str = os.environ.get("LLM_MODEL_NAME", "openai/gpt-4o-mini")
+    LLM_MODEL_NAME: str = Field(default="openai/gpt-4o-mini")
     LLM_TEMPERATURE: float = 0.1
     LLM_MAX_TOKENS: int = 2048
     LLM_REQUEST_TIMEOUT: int = 60
+    # LLM 响应的持久化缓存（SQLite），相同 prompt + 模型跨进程/重启复用
+    LLM_CACHE_DB: str = str(DATA_DIR / "llm_cache.db")
+    # 批量调用 LLM 时的最大并发请求数
+    LLM_BATCH_MAX_CONCURRENCY: int = 8
+    # 进程内缓存的推荐结果条数（键为 查询 + 文档 id）
+    RAG_RESPONSE_CACHE_SIZE: int = 1024
+    # 设置后再查一层 Redis 语义缓存（跨进程共享）：只向量化用户查询，且推荐文档 id 必须完全一致；
+    # 查询向量余弦距离不超过阈值即命中，释义相近的查询可复用同一批商品的推荐
+    REDIS_URL: str = ""
+    RAG_SEMANTIC_CACHE_THRESHOLD: float = 0.1
+    # 异步请求合批：在窗口期内收集并发请求，一次 abatch 发给 LLM（默认关闭）
+    RAG_BATCHING_ENABLED: bool = False
+    RAG_BATCH_WINDOW_MS: int = 30
+    RAG_MAX_BATCH: int = 16
+    # 设为 1 时各节点按阶段记录耗时（t_*_ms / total_ms），用于定位瓶颈
+    RAG_PROFILE: bool = False
+    # 服务启动时预热本地嵌入模型与 cross-encoder（含 FAISS / BM25 索引），不调用 LLM；
+    # 每个 uvicorn worker 各执行一次，会按 WEB_CONCURRENCY 倍增加启动耗时与内存峰值
+    ENABLE_WARMUP: bool = False
     
     # OpenRouter API Configuration
-    OPENAI_API_BASE: str = os.environ.get("OPENAI_API_BASE", "https://openrouter.ai/api/v1")
-    OPENAI_API_KEY: SecretStr | None = SecretStr(os.environ.get("OPENAI_API_KEY", ""))
+    OPENAI_API_BASE: str = Field(default="https://openrouter.ai/api/v1")
+    OPENAI_API_KEY: SecretStr | None = Field(default=SecretStr(""))
     
     # Ollama settings (fallback)
     # OLLAMA_MODEL_NAME: str = "llama3.1:8b"
     OLLAMA_MODEL_NAME: str = "qwen2.5:7b"
-    OLLAMA_HOST: str = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+    OLLAMA_HOST: str = Field(default="http://localhost:11434")
     
     # LLM Provider Selection
     USE_OPENROUTER: bool = True
@@ -77,14 +108,23 @@ class Settings(BaseSettings):
 
     # FAISS_INDEX_PATH: str = str(INDEX_DIR / "faiss_index.faiss")
     FAISS_INDEX_PATH: str = str(INDEX_DIR / "faiss_index")
-    BM25_INDEX_PATH: str = str(INDEX_DIR / "bm25_index.pkl")
+    # IVF-PQ 需要约 39 * nlist 个训练向量，低于阈值时保留精确的 Flat 索引；
+    # 需要更高召回时可改为标量量化，如 "IVF1024,SQ8"（int8，内存约为 float32 的 1/4）
+    FAISS_INDEX_FACTORY: str = "IVF1024,PQ64"
+    FAISS_IVF_MIN_DOCS: int = 40000
+    FAISS_NPROBE: int = 16
+    # 目录：BM25 得分矩阵 (.npy，可 mmap) + vocab.json + docs.jsonl；以 .pkl 结尾时沿用 pickle 格式
+    BM25_INDEX_PATH: str = str(INDEX_DIR / "bm25_index")
     CROSS_ENCODER_RERANKER_PATH: str = str(INDEX_DIR / "cross_encoder_reranker.pkl")
     CHROMA_INDEX_PATH: str = str(INDEX_DIR / "chroma_index")
+    INDEX_MANIFEST_PATH: str = str(INDEX_DIR / "manifest.json")
 
     # Guadrail settings
     GUARDRAIL_SETTINGS_DIR: str = str(BASE_DIR / "src" / "core" / "guardrail")
 
     TOTAL_TOP_K: int = 2
+    # 开启后 self-query 检索与 cross-encoder ranker 并行执行，代价是每次查询都会跑 ranker
+    PARALLEL_RETRIEVAL: bool = False
 
     FAISS_TOP_K: int = 3
     BM25_TOP_K: int = 3
@@ -114,4 +154,10 @@ class Settings(BaseSettings):
         os.makedirs(self.BASE_DIR / "logs", exist_ok=True)
 
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Returns the process-wide Settings instance, parsed once."""
+    return Settings()
+
+
+settings = get_settings()
@@ -3,6 +3,7 @@ This module processes the e-commerce dataset, generates embeddings,
 and indexes them using FAISS (vector search) and BM25 (lexical search).
 """
 
+import hashlib
 import json
 import os
 import pickle
@@ -10,7 +11,10 @@ import sys
 import warnings
 from typing import Optional
 
+import faiss
+import numpy as np
 import pandas as pd
+import torch
 from langchain_chroma import Chroma
 from langchain_community.document_loaders import CSVLoader
 from langchain_community.embeddings import HuggingFaceEmbeddings
@@ -24,21 +28,23 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")
 from src.config import settings
 # from src.indexing.data_loader import download_data
 from src.indexing.jieba_bm25 import create_jieba_bm25_index, save_jieba_bm25_index
-from src.recommender.utils import convert_item_to_page_content, get_product_details
+from src.recommender.utils import category_flag_key, convert_item_to_page_content, get_product_details, tag_categories
 
 warnings.filterwarnings("ignore")
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 
+RENAME_COLUMNS = {
+    "BrandName": "Brand Name",
+    "Sizes": "Available Sizes",
+    "SellPrice": "Product Price",
+    "Deatils": "Product Details",
+}
+
+
 def clean_column_names(df: pd.DataFrame) -> pd.DataFrame:
     """Renames columns to be more descriptive."""
-    rename_dict = {
-        "BrandName": "Brand Name",
-        "Sizes": "Available Sizes",
-        "SellPrice": "Product Price",
-        "Deatils": "Product Details",
-    }
-    return df.rename(columns={k: v for k, v in rename_dict.items() if k in df.columns})
+    return df.rename(columns={k: v for k, v in RENAME_COLUMNS.items() if k in df.columns})
 
 
 def load_and_preprocess_data(n_samples: Optional[int] = 2000) -> pd.DataFrame:
@@ -49,7 +55,13 @@ def load_and_preprocess_data(n_samples: Optional[int] = 2000) -> pd.DataFrame:
         )
         raise FileNotFoundError(f"Dataset not found at {settings.RAW_DATA_PATH}")
 
-    df = pd.read_csv(settings.RAW_DATA_PATH)
+    # 只解析需要的列，且全部按字符串读取，省去推断 dtype 与无用列的开销
+    df = pd.read_csv(
+        settings.RAW_DATA_PATH,
+        usecols=lambda col: col in RENAME_COLUMNS,
+        dtype="string",
+        engine="c",
+    )
     logger.info(f"Loaded dataset with {len(df)} records.")
 
     df = clean_column_names(df)
@@ -63,6 +75,8 @@ def load_and_preprocess_data(n_samples: Optional[int] = 2000) -> pd.DataFrame:
     ]
     df = df[[col for col in valid_columns if col in df.columns]]
 
+    # 先去掉空值再按已解析的记录抽样：引号内含换行的描述会跨多行，按物理行号抽样会错位，
+    # 抽样后再 dropna 也会少于 n_samples 条
     df.dropna(inplace=True)
 
     if n_samples and n_samples < len(df):
@@ -123,14 +137,24 @@ def load_and_preprocess_data(n_samples: Optional[int] = 2000) -> pd.DataFrame:
 #     return documents
 
 
-def generate_documents() -> list:
-    """Convert json data into LangChain Document objects."""
-    if not os.path.exists(settings.PROCESSED_DATA_PATH):
-        logger.info("Processed data file not found at {settings.PROCESSED_DATA_PATH}")
-        get_product_details()
-
-    with open(settings.PROCESSED_DATA_PATH, "r", encoding="utf-8") as f:
-        data = json.load(f)
+def generate_documents(data: Optional[list] = None) -> list:
+    """
+    Convert json data into LangChain Document objects.
+
+    Args:
+        data: Product items already in memory. When omitted, they are read from
+            `PROCESSED_DATA_PATH` (downloading them first if the file is missing).
+    """
+    if data is None:
+        if not os.path.exists(settings.PROCESSED_DATA_PATH):
+            logger.info(f"Processed data file not found at {settings.PROCESSED_DATA_PATH}")
+            # 直接使用下载结果，避免写盘后再读回解析一遍
+            data = get_product_details()
+            if data is None:
+                raise FileNotFoundError(f"Failed to fetch product details for {settings.PROCESSED_DATA_PATH}")
+        else:
+            with open(settings.PROCESSED_DATA_PATH, "r", encoding="utf-8") as f:
+                data = json.load(f)
     
     documents = []
     for item in data:
@@ -140,11 +164,20 @@ def generate_documents() -> list:
             if isinstance(value, (str, int, float, bool)) or value is None:
                 filtered_metadata[key] = value
             elif isinstance(value, list):
-                # 如果是列表，转换为字符串
-                filtered_metadata[key] = str(value)
+                # 如果是列表，序列化为 JSON 字符串（服务端可用 json.loads 解析，比 ast.literal_eval 快得多）
+                filtered_metadata[key] = json.dumps(value, ensure_ascii=False)
             else:
                 # 其他类型转换为字符串
                 filtered_metadata[key] = str(value)
+        categories = tag_categories(item.get("description"))
+        filtered_metadata["categories"] = categories
+        # Chroma 的 metadata 过滤不支持子串匹配，每个命中的品类另写一个布尔标记
+        for category in filter(None, categories.split(",")):
+            filtered_metadata[category_flag_key(category)] = True
+        # 入库时预先展开 variations，服务端拼接提示词时无需再解析
+        variations = item.get("variations") or []
+        filtered_metadata["sizes_csv"] = ", ".join(variation["sizeName"] for variation in variations)
+        filtered_metadata["first_color"] = variations[0]["colorName"] if variations else ""
         
         documents.append(
             Document(
@@ -158,23 +191,100 @@ def generate_documents() -> list:
     return documents
 
 
+def get_embeddings_model_kwargs() -> dict:
+    """Builds the SentenceTransformer kwargs: GPU + fp16 when CUDA is available, CPU fp32 otherwise."""
+    device = settings.EMBEDDINGS_DEVICE
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    model_kwargs = {"device": device}
+    if device.startswith("cuda"):
+        model_kwargs["model_kwargs"] = {"torch_dtype": torch.float16}
+    return model_kwargs
+
+
 def initialize_embeddings_model() -> HuggingFaceEmbeddings:
     """Initializes the HuggingFace embeddings model."""
     try:
         model_path = settings.EMBEDDINGS_MODEL_PATH
-        embeddings = HuggingFaceEmbeddings(model_name=model_path)
-        logger.info(f"Successfully initialized embeddings model: {settings.EMBEDDINGS_MODEL_NAME}")
+        model_kwargs = get_embeddings_model_kwargs()
+        embeddings = HuggingFaceEmbeddings(
+            model_name=model_path,
+            model_kwargs=model_kwargs,
+            encode_kwargs={"batch_size": settings.EMBEDDINGS_BATCH_SIZE},
+        )
+        logger.info(
+            f"Successfully initialized embeddings model: {settings.EMBEDDINGS_MODEL_NAME} "
+            f"on {model_kwargs['device']}"
+        )
         return embeddings
     except Exception as e:
         logger.exception("Failed to initialize embeddings model.")
         raise e
 
 
-def create_faiss_index(embeddings: HuggingFaceEmbeddings, documents: list) -> None:
-    """Creates and saves a FAISS index."""
+def build_quantized_faiss_index(vectors: np.ndarray) -> faiss.Index:
+    """
+    Trains a compressed IVF-PQ index for large corpora.
+
+    Training runs on GPU when faiss-gpu is installed; the trained index is
+    always moved back to CPU so it can be written with `save_local`.
+    """
+    index = faiss.index_factory(vectors.shape[1], settings.FAISS_INDEX_FACTORY)
+
+    if hasattr(faiss, "StandardGpuResources") and faiss.get_num_gpus() > 0:
+        logger.info("Training FAISS index on GPU...")
+        gpu_index = faiss.index_cpu_to_gpu(faiss.StandardGpuResources(), 0, index)
+        gpu_index.train(vectors)
+        gpu_index.add(vectors)
+        index = faiss.index_gpu_to_cpu(gpu_index)
+    else:
+        index.train(vectors)
+        index.add(vectors)
+
+    faiss.extract_index_ivf(index).nprobe = settings.FAISS_NPROBE
+    return index
+
+
+def embed_documents(embeddings: HuggingFaceEmbeddings, documents: list) -> np.ndarray:
+    """Encodes all document contents in one batched pass into a float32 matrix."""
+    logger.info(f"Embedding {len(documents)} documents...")
+    texts = [doc.page_content for doc in documents]
+    # 直接调用底层 SentenceTransformer，跳过 LangChain 逐条 tolist() 的转换，
+    # 整批结果以 float32 ndarray 交给 FAISS / Chroma
+    client = getattr(embeddings, "client", None)
+    if client is None or not hasattr(client, "encode"):
+        return np.asarray(embeddings.embed_documents(texts), dtype="float32")
+
+    vectors = client.encode(
+        texts,
+        batch_size=settings.EMBEDDINGS_BATCH_SIZE,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    )
+    return vectors.astype("float32", copy=False)
+
+
+def create_faiss_index(
+    embeddings: HuggingFaceEmbeddings, documents: list, vectors: Optional[np.ndarray] = None
+) -> None:
+    """Creates and saves a FAISS index, reusing precomputed `vectors` when given."""
     try:
         logger.info("Creating FAISS index...")
-        faiss_index = FAISS.from_documents(documents, embeddings)
+        if vectors is None:
+            vectors = embed_documents(embeddings, documents)
+
+        texts = [doc.page_content for doc in documents]
+        metadatas = [doc.metadata for doc in documents]
+        ids = [doc.id for doc in documents]
+        faiss_index = FAISS.from_embeddings(
+            list(zip(texts, vectors)), embeddings, metadatas=metadatas, ids=ids
+        )
+
+        # 小语料下精确的 Flat 索引最快；语料足够大时才换成需要训练的 IVF-PQ 压缩索引
+        if len(vectors) >= settings.FAISS_IVF_MIN_DOCS:
+            logger.info(f"Building {settings.FAISS_INDEX_FACTORY} index for {len(vectors)} vectors...")
+            faiss_index.index = build_quantized_faiss_index(vectors)
         os.makedirs(settings.FAISS_INDEX_PATH, exist_ok=True)   # 确保目录存在
         faiss_index.save_local(settings.FAISS_INDEX_PATH)
         logger.info(f"FAISS index saved at {settings.FAISS_INDEX_PATH}")
@@ -183,8 +293,10 @@ def create_faiss_index(embeddings: HuggingFaceEmbeddings, documents: list) -> No
         raise e
 
 
-def create_chroma_index(embeddings: HuggingFaceEmbeddings, documents: list) -> None:
-    """Creates and saves a Chroma index."""
+def create_chroma_index(
+    embeddings: HuggingFaceEmbeddings, documents: list, vectors: Optional[np.ndarray] = None
+) -> None:
+    """Creates and saves a Chroma index, reusing precomputed `vectors` when given."""
     try:
         logger.info("Creating Chroma index...")
         vector_store = Chroma(
@@ -192,7 +304,16 @@ def create_chroma_index(embeddings: HuggingFaceEmbeddings, documents: list) -> N
             embedding_function=embeddings,
             persist_directory=settings.CHROMA_INDEX_PATH,
         )
-        vector_store.add_documents(documents)
+        if vectors is None:
+            vector_store.add_documents(documents)
+        else:
+            # 直接写入已计算好的向量，跳过 Chroma 内部的重复编码
+            vector_store._collection.upsert(
+                ids=[doc.id for doc in documents],
+                embeddings=vectors,
+                documents=[doc.page_content for doc in documents],
+                metadatas=[doc.metadata for doc in documents],
+            )
         logger.info(f"Chroma index saved at {settings.CHROMA_INDEX_PATH}")
         logger.info(f"Number of documents in Chroma index: {len(documents)}")
     except Exception as e:
@@ -219,8 +340,58 @@ def create_bm25_index(documents: list) -> None:
         raise e
 
 
-def embedding_pipeline(n_samples: Optional[int] = None) -> None:
-    """Runs the entire embedding pipeline with lightweight settings."""
+def compute_corpus_fingerprint(documents: list) -> str:
+    """Hashes the documents together with the settings that shape the indexes."""
+    digest = hashlib.sha256()
+    digest.update(settings.EMBEDDINGS_MODEL_NAME.encode("utf-8"))
+    digest.update(settings.FAISS_INDEX_FACTORY.encode("utf-8"))
+    for doc in documents:
+        digest.update(
+            json.dumps(
+                [doc.id, doc.page_content, doc.metadata],
+                ensure_ascii=False,
+                sort_keys=True,
+                default=str,
+            ).encode("utf-8")
+        )
+    return digest.hexdigest()
+
+
+def indexes_up_to_date(fingerprint: str) -> bool:
+    """Checks the manifest written by the last successful run against `fingerprint`."""
+    index_paths = [
+        os.path.join(settings.FAISS_INDEX_PATH, "index.faiss"),
+        settings.BM25_INDEX_PATH,
+        settings.CHROMA_INDEX_PATH,
+    ]
+    if not os.path.exists(settings.INDEX_MANIFEST_PATH) or not all(
+        os.path.exists(path) for path in index_paths
+    ):
+        return False
+
+    with open(settings.INDEX_MANIFEST_PATH, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    return manifest.get("sha256") == fingerprint
+
+
+def write_index_manifest(fingerprint: str, n_documents: int) -> None:
+    """Records which corpus and model the current indexes were built from."""
+    manifest = {
+        "sha256": fingerprint,
+        "model": settings.EMBEDDINGS_MODEL_NAME,
+        "n": n_documents,
+    }
+    with open(settings.INDEX_MANIFEST_PATH, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def embedding_pipeline(n_samples: Optional[int] = None, force: bool = False) -> None:
+    """
+    Runs the entire embedding pipeline with lightweight settings.
+
+    The indexes are rebuilt only when the documents, the embeddings model or the
+    FAISS index type changed since the last run, unless `force` is set.
+    """
     try:
     #     # Use default sample size if not specified
     #     if n_samples is None:
@@ -234,11 +405,19 @@ def embedding_pipeline(n_samples: Optional[int] = None) -> None:
     #     download_data()
     #     df = load_and_preprocess_data(n_samples)
         documents = generate_documents()
+        fingerprint = compute_corpus_fingerprint(documents)
+        if not force and indexes_up_to_date(fingerprint):
+            logger.info("Indexes are up to date with the current documents. Skipping rebuild.")
+            return
+
         embeddings = initialize_embeddings_model()
+        # FAISS 与 Chroma 共用同一份向量，整个语料只编码一次
+        vectors = embed_documents(embeddings, documents)
 
-        create_faiss_index(embeddings, documents)
+        create_faiss_index(embeddings, documents, vectors)
         create_bm25_index(documents)
-        create_chroma_index(embeddings, documents)
+        create_chroma_index(embeddings, documents, vectors)
+        write_index_manifest(fingerprint, len(documents))
 
         logger.info("Lightweight embedding pipeline completed successfully.")
     except Exception as e:
@@ -2,18 +2,32 @@
 集成 jieba 分词器的 BM25 检索器实现
 """
 
+import asyncio
+import json
 import os
 import pickle
 import sys
 import warnings
-from typing import List
+from collections import Counter
+from functools import lru_cache, partial
+from multiprocessing import Pool
+from typing import List, Optional
 
-import jieba
-from rank_bm25 import BM25Okapi
+try:
+    # jieba_fast 是 jieba 的 C 扩展实现，接口一致；未安装时回退到纯 Python 版本
+    import jieba_fast as jieba
+except ImportError:
+    import jieba
+import numpy as np
 from langchain_core.documents import Document
 from loguru import logger
 from pydantic import PrivateAttr
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
 from langchain_core.retrievers import BaseRetriever
+from scipy.sparse import csr_matrix
 
 # Append project root directory
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
@@ -21,12 +35,72 @@ from src.config import settings
 
 warnings.filterwarnings("ignore")
 
+# 导入时预加载词典，避免首个查询承担词典加载耗时
+jieba.initialize()
+
+# 语料少于该规模时单进程分词：进程启动与各 worker 加载词典的开销比分词本身更大
+_MIN_PARALLEL_TEXTS = 2000
+
+
+def _init_jieba() -> None:
+    """进程池 worker 初始化：每个 worker 只加载一次 jieba 词典"""
+    jieba.initialize()
+
+
+def _tokenize(text: str, use_hmm: bool = False) -> List[str]:
+    """
+    jieba 分词并过滤空白 token（模块级函数，便于多进程 pickle）
+
+    商品文本以词典内的品牌/材质词为主，默认关闭 HMM，避免未登录词走逐字 Viterbi 的慢路径
+    """
+    return [token.strip() for token in jieba.lcut(text, HMM=use_hmm) if token.strip()]
+
+
+@lru_cache(maxsize=100_000)
+def _tokenize_cached(text: str, use_hmm: bool = False) -> tuple[str, ...]:
+    """带缓存的分词，返回不可变的 tuple，避免调用方修改缓存结果"""
+    return tuple(_tokenize(text, use_hmm))
+
+
+def tokenize_corpus(
+    texts: List[str], n_jobs: Optional[int] = None, use_hmm: bool = False
+) -> List[List[str]]:
+    """
+    用常驻进程池并行分词，完全重复的文本只分词一次
+
+    Args:
+        texts: 文本列表
+        n_jobs: 进程数，默认 os.cpu_count()
+        use_hmm: 是否启用 jieba 的 HMM 新词发现，需与查询时一致
+
+    Returns:
+        与 texts 一一对应的分词结果
+    """
+    unique_texts = list(dict.fromkeys(texts))
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(unique_texts))
+
+    if n_jobs <= 1 or len(unique_texts) < _MIN_PARALLEL_TEXTS:
+        tokenized = [_tokenize(text, use_hmm) for text in unique_texts]
+    else:
+        chunksize = max(1, len(unique_texts) // (n_jobs * 4))
+        with Pool(n_jobs, initializer=_init_jieba) as pool:
+            tokenized = pool.map(partial(_tokenize, use_hmm=use_hmm), unique_texts, chunksize=chunksize)
+
+    tokens_by_text = dict(zip(unique_texts, tokenized))
+    return [tokens_by_text[text] for text in texts]
+
 
 class JiebaTokenizer:
     """使用 jieba 进行中文分词的自定义分词器"""
     
-    def __init__(self):
-        """初始化 jieba 分词器"""
+    def __init__(self, use_hmm: bool = False):
+        """
+        初始化 jieba 分词器
+
+        Args:
+            use_hmm: 是否启用 HMM 新词发现
+        """
+        self.use_hmm = use_hmm
         logger.info("Initialized jieba tokenizer")
     
     def tokenize(self, text: str) -> List[str]:
@@ -34,26 +108,30 @@ class JiebaTokenizer:
         使用 jieba 对文本进行分词
         
         Args:
-            text: 输入文本（可能是字符串或列表）
+            text: 输入文本
             
         Returns:
             分词结果列表
         """
-        # 如果输入已经是列表（多进程传递的结果），直接返回
+        # 语料在建索引前已分好词，不会再把 token 列表传进来；收到列表说明调用方有误
         if isinstance(text, list):
-            return text
-        
-        # 使用 jieba 进行分词
-        tokens = jieba.lcut(text)
+            raise TypeError("JiebaTokenizer.tokenize expects a string, got an already tokenized list")
         
-        # 过滤空字符串和空格
-        tokens = [token.strip() for token in tokens if token.strip()]
-        
-        return tokens
+        # 使用 jieba 进行分词，并过滤空字符串和空格；相同文本直接命中缓存
+        return list(_tokenize_cached(text, getattr(self, "use_hmm", False)))
 
 
 class JiebaBM25Retriever:
-    """集成 jieba 分词器的 BM25 检索器"""
+    """
+    集成 jieba 分词器的 BM25 检索器
+
+    建索引时即计算好每个 (词, 文档) 的 BM25 Okapi 得分，存为 |V| x |C| 的稀疏矩阵，
+    查询时只需取出查询词对应的行求和，打分与 rank_bm25.BM25Okapi 一致。
+    """
+
+    k1 = 1.5
+    b = 0.75
+    epsilon = 0.25
     
     def __init__(self, documents: List[Document]):
         """
@@ -64,22 +142,85 @@ class JiebaBM25Retriever:
         """
         self.tokenizer = JiebaTokenizer()
         self.documents = documents
-        self.bm25 = self._build_bm25_index()
+        self.term_doc_matrix = self._build_bm25_index()
+
+    @classmethod
+    def from_index(
+        cls, documents: List[Document], term_doc_matrix: csr_matrix, vocab: dict
+    ) -> "JiebaBM25Retriever":
+        """由已持久化的得分矩阵与词表直接构造，跳过分词与打分"""
+        retriever = cls.__new__(cls)
+        retriever.tokenizer = JiebaTokenizer()
+        retriever.documents = documents
+        retriever.vocab = vocab
+        retriever.term_doc_matrix = term_doc_matrix
+        return retriever
+
+    def __getstate__(self) -> dict:
+        """
+        从目录格式加载的索引只序列化目录路径：cross_encoder_reranker.pkl 内嵌本检索器，
+        服务启动反序列化时重新按 mmap 打开目录，得分矩阵与文档不会被整体写入 / 读出 pickle
+        """
+        index_path = self.__dict__.get("index_path")
+        if index_path:
+            return {"index_path": index_path}
+        return self.__dict__
+
+    def __setstate__(self, state: dict) -> None:
+        """兼容旧版以 BM25Okapi 为后端序列化的索引：加载时按新格式重建"""
+        if "index_path" in state and "term_doc_matrix" not in state:
+            # 构建 pickle 的机器上的绝对路径可能不存在（如镜像内路径不同），回退到当前配置
+            index_path = state["index_path"]
+            if not os.path.isdir(index_path):
+                index_path = settings.BM25_INDEX_PATH
+            self.__dict__.update(load_jieba_bm25_index(index_path).__dict__)
+            return
+
+        self.__dict__.update(state)
+        if "term_doc_matrix" not in state:
+            logger.warning("Legacy BM25Okapi index detected, rebuilding sparse BM25 index")
+            self.__dict__.pop("bm25", None)
+            self.term_doc_matrix = self._build_bm25_index()
     
-    def _build_bm25_index(self) -> BM25Okapi:
-        """构建 BM25 索引"""
-        # 提取文档内容
-        corpus = []
-        for doc in self.documents:
-            # 使用 jieba 分词处理文档内容
-            tokens = self.tokenizer.tokenize(doc.page_content)
-            corpus.append(tokens)
-        
-        # 创建 BM25 索引
-        bm25 = BM25Okapi(corpus, tokenizer=self.tokenizer.tokenize)
+    def _build_bm25_index(self, n_jobs: Optional[int] = None) -> csr_matrix:
+        """构建 BM25 索引，同时生成词表 self.vocab"""
+        # 多进程并行分词处理文档内容
+        corpus = tokenize_corpus(
+            [doc.page_content for doc in self.documents],
+            n_jobs=n_jobs,
+            use_hmm=getattr(self.tokenizer, "use_hmm", False),
+        )
+        n_docs = len(corpus)
+
+        # 收集每个 (词, 文档) 的词频
+        self.vocab = {}
+        rows, cols, tfs = [], [], []
+        for doc_idx, tokens in enumerate(corpus):
+            for token, tf in Counter(tokens).items():
+                rows.append(self.vocab.setdefault(token, len(self.vocab)))
+                cols.append(doc_idx)
+                tfs.append(tf)
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        tfs = np.asarray(tfs, dtype=np.float64)
+
+        # IDF 与 BM25Okapi 相同：负 IDF 用 epsilon * 平均 IDF 代替
+        doc_freqs = np.bincount(rows, minlength=len(self.vocab))
+        idf = np.log(n_docs - doc_freqs + 0.5) - np.log(doc_freqs + 0.5)
+        if len(idf):
+            idf[idf < 0] = self.epsilon * idf.mean()
+
+        doc_len = np.fromiter(map(len, corpus), dtype=np.float64, count=n_docs)
+        avgdl = doc_len.mean() if n_docs and doc_len.mean() > 0 else 1.0
+        norm = self.k1 * (1 - self.b + self.b * doc_len[cols] / avgdl)
+        scores = idf[rows] * tfs * (self.k1 + 1) / (tfs + norm)
+
+        matrix = csr_matrix(
+            (scores.astype(np.float32), (rows, cols)), shape=(len(self.vocab), n_docs)
+        )
         
         logger.info(f"Built BM25 index with jieba tokenizer for {len(self.documents)} documents")
-        return bm25
+        return matrix
     
     def get_relevant_documents(self, query: str, top_k: int = 5) -> List[Document]:
         """
@@ -92,24 +233,30 @@ class JiebaBM25Retriever:
         Returns:
             相关文档列表
         """
-        # 使用 jieba 分词处理查询
-        query_tokens = self.tokenizer.tokenize(query)
-        
         # 获取 BM25 分数
-        scores = self.bm25.get_scores(query_tokens)
-        
-        # 获取 top_k 个最相关的文档
-        top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
+        scores = self.get_scores(query)
         
-        relevant_docs = []
-        for idx in top_indices:
-            if scores[idx] > 0:  # 只返回有相关性的文档
-                relevant_docs.append(self.documents[idx])
+        # 获取 top_k 个最相关的文档：argpartition 做 O(n) 部分选择，只对候选排序
+        top_k = min(top_k, len(scores))
+        if top_k <= 0:
+            return []
+        top_indices = np.argpartition(-scores, top_k - 1)[:top_k]
+        top_indices = top_indices[np.argsort(-scores[top_indices], kind="stable")]
+        # 只返回有相关性的文档
+        top_indices = top_indices[scores[top_indices] > 0]
+
+        relevant_docs = [self.documents[idx] for idx in top_indices]
         
         logger.info(f"Retrieved {len(relevant_docs)} relevant documents for query: {query}")
         return relevant_docs
     
-    def get_scores(self, query: str) -> List[float]:
+    async def aget_relevant_documents(self, query: str, top_k: int = 5) -> List[Document]:
+        """
+        异步检索：打分是释放 GIL 的 numpy/scipy 运算，放到线程中执行，不阻塞事件循环
+        """
+        return await asyncio.to_thread(self.get_relevant_documents, query, top_k)
+
+    def get_scores(self, query: str) -> np.ndarray:
         """
         获取查询与所有文档的相关性分数
         
@@ -117,10 +264,14 @@ class JiebaBM25Retriever:
             query: 查询文本
             
         Returns:
-            分数列表
+            分数数组
         """
+        # 使用 jieba 分词处理查询；重复出现的词与 BM25Okapi 一样重复计分
         query_tokens = self.tokenizer.tokenize(query)
-        return self.bm25.get_scores(query_tokens)
+        rows = [self.vocab[token] for token in query_tokens if token in self.vocab]
+        if not rows:
+            return np.zeros(self.term_doc_matrix.shape[1], dtype=np.float32)
+        return np.asarray(self.term_doc_matrix[rows].sum(axis=0)).ravel()
     
 
 class JiebaBM25LangChainRetriever(BaseRetriever):
@@ -131,8 +282,15 @@ class JiebaBM25LangChainRetriever(BaseRetriever):
         super().__init__()
         self._jieba_bm25 = jieba_bm25
 
-    def get_relevant_documents(self, query: str) -> List[Document]:
-        return self._jieba_bm25.get_relevant_documents(query) 
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self._jieba_bm25.get_relevant_documents(query)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return await self._jieba_bm25.aget_relevant_documents(query)
 
 
 def create_jieba_bm25_index(documents: List[Document]) -> JiebaBM25Retriever:
@@ -155,19 +313,40 @@ def create_jieba_bm25_index(documents: List[Document]) -> JiebaBM25Retriever:
         raise e
 
 
+_MATRIX_FILES = ("data", "indices", "indptr")
+
+
 def save_jieba_bm25_index(retriever: JiebaBM25Retriever, file_path: str) -> None:
     """
     保存 JiebaBM25 索引
+
+    file_path 以 .pkl 结尾时整体 pickle（兼容旧格式）；否则视为目录，写入
+    得分矩阵的 data/indices/indptr 三个 .npy、vocab.json 和 docs.jsonl。
     
     Args:
         retriever: JiebaBM25Retriever 实例
         file_path: 保存路径
     """
     try:
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        
-        with open(file_path, "wb") as f:
-            pickle.dump(retriever, f)
+        if file_path.endswith(".pkl"):
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, "wb") as f:
+                pickle.dump(retriever, f)
+        else:
+            os.makedirs(file_path, exist_ok=True)
+            matrix = retriever.term_doc_matrix
+            for name in _MATRIX_FILES:
+                np.save(os.path.join(file_path, f"{name}.npy"), getattr(matrix, name))
+
+            # 词表按矩阵行号顺序保存
+            terms = sorted(retriever.vocab, key=retriever.vocab.get)
+            with open(os.path.join(file_path, "vocab.json"), "w", encoding="utf-8") as f:
+                json.dump(terms, f, ensure_ascii=False)
+
+            with open(os.path.join(file_path, "docs.jsonl"), "w", encoding="utf-8") as f:
+                for doc in retriever.documents:
+                    record = {"id": doc.id, "page_content": doc.page_content, "metadata": doc.metadata}
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
         
         logger.info(f"JiebaBM25 index saved at {file_path}")
     except Exception as e:
@@ -178,6 +357,9 @@ def save_jieba_bm25_index(retriever: JiebaBM25Retriever, file_path: str) -> None
 def load_jieba_bm25_index(file_path: str) -> JiebaBM25Retriever:
     """
     加载 JiebaBM25 索引
+
+    目录格式下得分矩阵以 mmap 方式打开，查询时才按需读入被访问的部分；
+    这样加载的检索器再被 pickle（如嵌入 cross-encoder reranker）时只记录目录路径。
     
     Args:
         file_path: 索引文件路径
@@ -186,8 +368,32 @@ def load_jieba_bm25_index(file_path: str) -> JiebaBM25Retriever:
         JiebaBM25Retriever 实例
     """
     try:
-        with open(file_path, "rb") as f:
-            retriever = pickle.load(f)
+        if file_path.endswith(".pkl"):
+            with open(file_path, "rb") as f:
+                try:
+                    retriever = pickle.load(f)
+                except ModuleNotFoundError as e:
+                    if e.name != "rank_bm25":
+                        raise
+                    # 旧版 pickle 内含 rank_bm25.BM25Okapi 对象，项目已不再依赖 rank-bm25
+                    raise RuntimeError(
+                        f"{file_path} is a legacy BM25Okapi index; rebuild it with `make indexing` "
+                        "(or install rank-bm25 to load it once)"
+                    ) from e
+        else:
+            with open(os.path.join(file_path, "vocab.json"), "r", encoding="utf-8") as f:
+                terms = json.load(f)
+            with open(os.path.join(file_path, "docs.jsonl"), "r", encoding="utf-8") as f:
+                documents = [Document(**json.loads(line)) for line in f]
+
+            data, indices, indptr = (
+                np.load(os.path.join(file_path, f"{name}.npy"), mmap_mode="r")
+                for name in _MATRIX_FILES
+            )
+            matrix = csr_matrix((data, indices, indptr), shape=(len(terms), len(documents)), copy=False)
+            vocab = {term: row for row, term in enumerate(terms)}
+            retriever = JiebaBM25Retriever.from_index(documents, matrix, vocab)
+            retriever.index_path = file_path
         
         logger.info(f"JiebaBM25 index loaded from {file_path}")
         return retriever
@@ -1,12 +1,11 @@
-import os
-import sys
+import re
+import threading
+from collections import OrderedDict
 
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
+from loguru import logger
 
-# Local imports
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from src.config import settings
 from src.recommender.state import RecState
 from src.recommender.llm_factory import get_llm
@@ -21,14 +20,8 @@ class GradeTopic(BaseModel):
     )
 
 
-def topic_classifier(state: RecState):
-    """
-    Classifies whether the user's query is related to fashion product recommendations.
-    """
-    query = state["query"]
-
-    # Improved system prompt with multilingual support
-    system = """你是一个分类器，用于判断用户的查询是否与服装推荐相关。
+# Improved system prompt with multilingual support
+_SYSTEM_PROMPT = """你是一个分类器，用于判断用户的查询是否与服装推荐相关。
 
     你的任务是分析查询，如果它是关于推荐服装，则回复"Yes"；如果无关，则回复"No"。
 
@@ -45,55 +38,178 @@ def topic_classifier(state: RecState):
     请只回复"Yes"或"No"。
     """
 
-    # Define the prompt template
-    grade_prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", system),
-            ("human", "User query: {query}"),
-        ]
-    )
+# Define the prompt template
+_GRADE_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", _SYSTEM_PROMPT),
+        ("human", "User query: {query}"),
+    ]
+)
+
+
+# 本地关键词快速判断：只命中正向词判 Yes，只命中负向词判 No，两者都命中或都未命中时再交给 LLM
+_FASHION_POS_KEYWORDS = [
+    "裙", "裤", "衬衫", "T恤", "夹克", "外套", "背心", "上衣", "卫衣", "毛衣", "针织",
+    "西装", "风衣", "大衣", "羽绒", "鞋", "靴", "穿搭", "搭配", "服装", "衣服",
+    "dress", "skirt", "shirt", "jacket", "coat", "pants", "jeans", "shoes", "outfit",
+]
+_FASHION_NEG_KEYWORDS = [
+    "密码", "天气", "笑话", "忽略之前", "登录", "退款", "物流",
+    "password", "weather", "joke", "ignore previous",
+]
+
+
+def _compile_keywords(keywords: list[str]) -> re.Pattern:
+    """
+    Compiles keywords into one alternation: CJK terms match as substrings,
+    ASCII words only as whole words (optionally plural), so "address" does not
+    hit "dress". re.ASCII makes \\b treat CJK characters as non-word, so
+    "推荐dress" still matches.
+    """
+    cjk = [re.escape(keyword) for keyword in keywords if not keyword.isascii()]
+    ascii_words = [re.escape(keyword) for keyword in keywords if keyword.isascii()]
+    alternatives = cjk + [rf"\b(?:{'|'.join(ascii_words)})(?:e?s)?\b"] if ascii_words else cjk
+    return re.compile("|".join(alternatives), re.IGNORECASE | re.ASCII)
+
+
+_FASHION_POS_RE = _compile_keywords(_FASHION_POS_KEYWORDS)
+_FASHION_NEG_RE = _compile_keywords(_FASHION_NEG_KEYWORDS)
+
+
+def _keyword_classify(query: str) -> str | None:
+    """Returns "Yes"/"No" when keywords decide the query unambiguously, else None."""
+    positive = _FASHION_POS_RE.search(query) is not None
+    negative = _FASHION_NEG_RE.search(query) is not None
+    if positive and not negative:
+        return "Yes"
+    if negative and not positive:
+        return "No"
+    return None
+
+
+def _fallback_classify(llm, query: str) -> str:
+    """Uses a simple LLM response when structured output is unavailable."""
+    fallback_response = llm.invoke(_GRADE_PROMPT.format(query=query))
+    response_text = fallback_response.content.strip().lower()
+    if "yes" in response_text or "是" in response_text:
+        return "Yes"
+    return "No"
+
+
+# LLM 分类结果的进程内 LRU；单条与批量入口共用，关键词能判定的查询不入缓存
+_TOPIC_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_TOPIC_CACHE_SIZE = 1024
+_topic_cache_lock = threading.Lock()
+
+
+def _get_cached_label(query: str) -> str | None:
+    with _topic_cache_lock:
+        label = _TOPIC_CACHE.get(query)
+        if label is not None:
+            _TOPIC_CACHE.move_to_end(query)
+        return label
+
+
+def _set_cached_label(query: str, label: str) -> None:
+    with _topic_cache_lock:
+        _TOPIC_CACHE[query] = label
+        _TOPIC_CACHE.move_to_end(query)
+        while len(_TOPIC_CACHE) > _TOPIC_CACHE_SIZE:
+            _TOPIC_CACHE.popitem(last=False)
+
+
+def _build_grader(llm):
+    return _GRADE_PROMPT | llm.with_structured_output(GradeTopic)
+
+
+def _classify(query: str) -> str:
+    """
+    Returns "Yes" or "No" for a query; results are memoized per process.
+
+    Raises when both the structured and the plain LLM call fail, so that
+    transient errors are not cached.
+    """
+    label = _get_cached_label(query)
+    if label is not None:
+        return label
 
     # Initialize the LLM using the factory
     llm = get_llm("auto")
 
+    label = None
     try:
-        # Add structured output to the LLM
-        structured_llm = llm.with_structured_output(GradeTopic)
+        # Invoke the structured grader with the user's query
+        result = _build_grader(llm).invoke({"query": query})
 
-        # Create the grader chain
-        grader_llm = grade_prompt | structured_llm
+        if result and hasattr(result, 'score'):
+            label = result.score
+    except Exception:
+        # Fall through to the simple LLM response when structured output fails
+        pass
+
+    if label is None:
+        label = _fallback_classify(llm, query)
+    _set_cached_label(query, label)
+    return label
+
+
+def topic_classifier(state: RecState):
+    """
+    Classifies whether the user's query is related to fashion product recommendations.
+    """
+    query = state["query"]
 
-        # Invoke the grader with the user's query
-        result = grader_llm.invoke({"query": query})
+    label = _keyword_classify(query)
+    if label is not None:
+        logger.info(f"Topic classified by keywords: {label}")
+        state["on_topic"] = label
+        return state
 
+    try:
         # Update the state with the classification result
-        if result and hasattr(result, 'score'):
-            state["on_topic"] = result.score
-        else:
-            # Fallback: use simple LLM response
-            fallback_response = llm.invoke(grade_prompt.format(query=query))
-            response_text = fallback_response.content.strip().lower()
-            if "yes" in response_text or "是" in response_text:
-                state["on_topic"] = "Yes"
-            else:
-                state["on_topic"] = "No"
-                
-    except Exception as e:
-        # Fallback: use simple LLM response when structured output fails
-        try:
-            fallback_response = llm.invoke(grade_prompt.format(query=query))
-            response_text = fallback_response.content.strip().lower()
-            if "yes" in response_text or "是" in response_text:
-                state["on_topic"] = "Yes"
-            else:
-                state["on_topic"] = "No"
-        except Exception as fallback_error:
-            # If all else fails, default to "No"
-            state["on_topic"] = "No"
+        state["on_topic"] = _classify(query)
+        logger.info(f"Topic classified by LLM: {state['on_topic']}")
+    except Exception:
+        # If all else fails, default to "No"
+        state["on_topic"] = "No"
 
     return state
 
 
+def batch_classify(queries: list[str]) -> list[str]:
+    """
+    Classifies several queries, matching `topic_classifier` label for label.
+
+    Keyword hits and cached labels are resolved locally; only the remaining
+    distinct queries go to the LLM in one concurrent `batch` call. Queries
+    whose structured call fails go through the single-query path, which also
+    falls back to "No" when every attempt fails.
+    """
+    labels = [_keyword_classify(query) or _get_cached_label(query) for query in queries]
+    undecided = list(dict.fromkeys(query for query, label in zip(queries, labels) if label is None))
+    if not undecided:
+        return labels
+
+    try:
+        results = _build_grader(get_llm("auto")).batch(
+            [{"query": query} for query in undecided],
+            config={"max_concurrency": settings.LLM_BATCH_MAX_CONCURRENCY},
+            return_exceptions=True,
+        )
+    except Exception:
+        results = [None] * len(undecided)
+
+    decided = {}
+    for query, result in zip(undecided, results):
+        if result is not None and not isinstance(result, Exception) and hasattr(result, "score"):
+            decided[query] = result.score
+            _set_cached_label(query, result.score)
+        else:
+            decided[query] = topic_classifier({"query": query})["on_topic"]
+    logger.info(f"Topic classified {len(undecided)}/{len(queries)} queries by batched LLM call")
+    return [label if label is not None else decided[query] for query, label in zip(queries, labels)]
+
+
 if __name__ == "__main__":
     state = {"query": "What are the best dresses for summer?"}
     output = topic_classifier(state)
@@ -1,22 +1,49 @@
-import os
-import sys
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 from langchain.globals import set_debug
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import END, StateGraph
 from loguru import logger
 
-# Append project root directory
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 from src.recommender.check_topic_node import topic_classifier
-from src.recommender.rag_node import rag_recommender
-from src.recommender.ranker_node import ranker_node
-from src.recommender.self_query_node import build_self_query_chain
-from src.recommender.state import RecState
+from src.recommender.rag_node import arag_recommender, rag_recommender
+from src.recommender.ranker_node import build_ranker, ranker_node
+from src.recommender.state import RecState, initial_state
+from src.recommender.utils import extract_category_from_query, filter_docs_by_category
 from src.config import settings
 
 set_debug(True)
 
 
+def _safe_build_ranker(query: str) -> list:
+    """Runs the cross-encoder ranker, returning no documents on failure."""
+    try:
+        return build_ranker(query)
+    except Exception as e:
+        logger.error(f"Error in ranker during hybrid retrieval: {e}")
+        return []
+
+
+def _merge_hybrid_docs(state, self_query_docs: list, ranker_docs: list):
+    """
+    Combines self-query and ranker results the way the sequential path does:
+    category-filtered self-query docs first, topped up with unseen ranker docs.
+    """
+    category = extract_category_from_query(state["query"])
+    docs = filter_docs_by_category(self_query_docs, category)
+    seen = {doc.id for doc in docs}
+    for doc in ranker_docs:
+        if len(docs) >= settings.TOTAL_TOP_K:
+            break
+        if doc.id not in seen:
+            seen.add(doc.id)
+            docs.append(doc)
+    state["docs"] = docs
+    state["ranker_attempted"] = True
+    return state
+
+
 def create_recommendaer_graph():
     workflow = StateGraph(RecState)
 
@@ -24,7 +51,12 @@ def create_recommendaer_graph():
     def self_query_retrieve(state):
         """Self query retrieve node wrapper"""
         try:
-            from src.recommender.self_query_node import initialize_embeddings_model, load_chroma_index
+            # 延迟导入：Chroma / embeddings 依赖较重，首次执行该节点时才加载
+            from src.recommender.self_query_node import (
+                build_self_query_chain,
+                initialize_embeddings_model,
+                load_chroma_index,
+            )
             embeddings = initialize_embeddings_model()
             chroma_index = load_chroma_index(embeddings)
             self_query_chain = build_self_query_chain(chroma_index)
@@ -53,8 +85,32 @@ def create_recommendaer_graph():
             state["recommendation"] = "很抱歉，我目前只支持时尚穿搭相关的智能推荐。请提问与时尚穿搭相关的问题。"
         return state
 
+    # 并行检索：self-query 与 cross-encoder ranker 同时执行，耗时取二者最大值
+    def hybrid_retrieve(state):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            self_query_future = executor.submit(self_query_retrieve, {**state, "docs": []})
+            ranker_future = executor.submit(_safe_build_ranker, state["query"])
+            self_query_docs = self_query_future.result().get("docs") or []
+            ranker_docs = ranker_future.result()
+        return _merge_hybrid_docs(state, self_query_docs, ranker_docs)
+
+    async def ahybrid_retrieve(state):
+        self_query_state, ranker_docs = await asyncio.gather(
+            asyncio.to_thread(self_query_retrieve, {**state, "docs": []}),
+            asyncio.to_thread(_safe_build_ranker, state["query"]),
+        )
+        return _merge_hybrid_docs(state, self_query_state.get("docs") or [], ranker_docs)
+
     workflow.add_node("self_query_retrieve", self_query_retrieve)
-    workflow.add_node("rag_recommender", rag_recommender)
+    if settings.PARALLEL_RETRIEVAL:
+        workflow.add_node(
+            "hybrid_retrieve", RunnableLambda(hybrid_retrieve, afunc=ahybrid_retrieve)
+        )
+        workflow.add_edge("hybrid_retrieve", "rag_recommender")
+    # 同步 invoke 走 rag_recommender，ainvoke 时走 arag_recommender 异步等待 LLM
+    workflow.add_node(
+        "rag_recommender", RunnableLambda(rag_recommender, afunc=arag_recommender)
+    )
     workflow.add_node("ranker", ranker_node)
     workflow.add_node("check_topic", topic_classifier)
     workflow.add_node("not_fashion_llm_response", not_fashion_llm_response)  # 新增节点
@@ -66,7 +122,10 @@ def create_recommendaer_graph():
     workflow.add_conditional_edges(
         "check_topic",
         lambda state: state["on_topic"],
-        {"Yes": "self_query_retrieve", "No": "not_fashion_llm_response"},  # 修改分支
+        {
+            "Yes": "hybrid_retrieve" if settings.PARALLEL_RETRIEVAL else "self_query_retrieve",
+            "No": "not_fashion_llm_response",
+        },  # 修改分支
     )
 
     workflow.add_conditional_edges(
@@ -85,6 +144,47 @@ def create_recommendaer_graph():
     return workflow.compile()
 
 
+def recommend_batch(app, queries: list[str]) -> list[dict]:
+    """
+    Runs the compiled graph for several queries; node LLM calls run concurrently.
+    """
+    # 与 /recommend 接口相同的初始状态，条件边与 ranker 节点依赖 docs / ranker_attempted
+    states = [initial_state(query) for query in queries]
+    return app.batch(states, config={"max_concurrency": settings.LLM_BATCH_MAX_CONCURRENCY})
+
+
+def warmup() -> None:
+    """
+    Loads and exercises the local parts of the pipeline once: the embeddings
+    model, the Chroma vector store (one similarity search), the self-query
+    chain (query constructor + retriever; building it creates the LLM client
+    but sends no request) and the cross-encoder ranker, whose pickle carries
+    the FAISS and BM25 indexes. No LLM request is made, so warmup never
+    issues a billed API call; failures are logged, not raised.
+    """
+    from src.recommender.self_query_node import (
+        build_self_query_chain,
+        initialize_embeddings_model,
+        load_chroma_index,
+    )
+
+    def chroma_index():
+        return load_chroma_index(initialize_embeddings_model())
+
+    steps = (
+        ("embeddings", lambda: initialize_embeddings_model().embed_query("warmup query for models")),
+        ("chroma", lambda: chroma_index().similarity_search("warmup query for models", k=1)),
+        ("self-query chain", lambda: build_self_query_chain(chroma_index())),
+        ("ranker", lambda: build_ranker("warmup")),
+    )
+    for name, step in steps:
+        try:
+            step()
+            logger.info(f"Warmup: {name} ready")
+        except Exception as e:
+            logger.warning(f"Warmup: {name} failed: {e}")
+
+
 if __name__ == "__main__":
     app = create_recommendaer_graph()
     app.get_graph().draw_mermaid_png(output_file_path="flow.png")
@@ -2,11 +2,23 @@
 Lightweight models for resource-constrained environments.
 """
 
+import os
+
 from langchain_huggingface import HuggingFaceEmbeddings
 from loguru import logger
 from src.config import settings
 
 
+def lightweight_embeddings_model_path() -> str:
+    """
+    Local snapshot directory of `LIGHTWEIGHT_EMBEDDINGS_MODEL`; shares
+    `EMBEDDINGS_MODEL_PATH` when both settings name the same hub model.
+    """
+    if settings.LIGHTWEIGHT_EMBEDDINGS_MODEL == settings.EMBEDDINGS_MODEL_NAME:
+        return settings.EMBEDDINGS_MODEL_PATH
+    return settings.LIGHTWEIGHT_EMBEDDINGS_MODEL_PATH
+
+
 def get_lightweight_embeddings():
     """
     Get a lightweight embeddings model for resource-constrained environments.
@@ -15,17 +27,35 @@ def get_lightweight_embeddings():
         HuggingFaceEmbeddings: A lightweight embeddings model.
     """
     try:
-        # Use a smaller, faster model for lightweight deployment
+        # Use a smaller, faster model for lightweight deployment; prefer the
+        # snapshot from download_models.py (incl. its ONNX export) over the hub
         model_name = settings.LIGHTWEIGHT_EMBEDDINGS_MODEL
+        local_path = lightweight_embeddings_model_path()
+        if os.path.isfile(os.path.join(local_path, "config.json")):
+            model_name = local_path
         logger.info(f"Loading lightweight embeddings model: {model_name}")
         
+        # Force CPU for lightweight deployment; the ONNX Runtime backend (optionally
+        # int8-quantized) is noticeably faster than torch on CPU
+        model_kwargs = {'device': 'cpu'}
+        if settings.LIGHTWEIGHT_EMBEDDINGS_BACKEND == "onnx":
+            model_kwargs['backend'] = "onnx"
+            if settings.LIGHTWEIGHT_EMBEDDINGS_ONNX_FILE:
+                model_kwargs['model_kwargs'] = {'file_name': settings.LIGHTWEIGHT_EMBEDDINGS_ONNX_FILE}
+
         embeddings = HuggingFaceEmbeddings(
             model_name=model_name,
-            model_kwargs={'device': 'cpu'},  # Force CPU for lightweight deployment
-            encode_kwargs={'normalize_embeddings': True}
+            model_kwargs=model_kwargs,
+            encode_kwargs={
+                'normalize_embeddings': True,
+                'batch_size': settings.LIGHTWEIGHT_EMBEDDINGS_BATCH_SIZE,
+            }
         )
         
-        logger.info("Lightweight embeddings model loaded successfully")
+        logger.info(
+            f"Lightweight embeddings model loaded successfully "
+            f"({settings.LIGHTWEIGHT_EMBEDDINGS_BACKEND} backend)"
+        )
         return embeddings
         
     except Exception as e:
@@ -3,26 +3,54 @@ LLM Factory Module
 统一管理不同的LLM提供商（OpenRouter、Ollama等）
 """
 
-import os
-import sys
-from typing import Optional
+from __future__ import annotations
+
+import threading
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
 
-from langchain_openai import ChatOpenAI
-from langchain_ollama import ChatOllama
 from loguru import logger
 
-# Local imports
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+if TYPE_CHECKING:
+    # 仅用于类型标注；实际导入推迟到首次创建对应客户端时，只用到一个提供商时不加载另一个
+    from langchain_ollama import ChatOllama
+    from langchain_openai import ChatOpenAI
 
 from src.config import settings
 
+_cache_lock = threading.Lock()
+_cache_initialized = False
+
+
+def init_llm_cache() -> None:
+    """
+    Sets up the exact-match SQLite LLM cache once per process.
+
+    The cache is global and serves every LLM call (topic grader, self-query
+    constructor, RAG chain), so it must only hit on an identical prompt; the
+    semantic lookup lives in the RAG node instead. Called lazily from
+    `get_llm`, so importing the recommender modules has no side effect on disk.
+    """
+    global _cache_initialized
+    with _cache_lock:
+        if _cache_initialized:
+            return
 
+        from langchain.globals import set_llm_cache
+        from langchain_community.cache import SQLiteCache
+
+        set_llm_cache(SQLiteCache(database_path=settings.LLM_CACHE_DB))
+        _cache_initialized = True
+
+
+@lru_cache(maxsize=1)
 def create_openrouter_llm() -> ChatOpenAI:
     """
-    创建OpenRouter的ChatOpenAI实例
+    创建OpenRouter的ChatOpenAI实例（进程内复用，创建失败不缓存）
     """
     try:
+        from langchain_openai import ChatOpenAI
+
         if not settings.OPENAI_API_KEY:
             raise ValueError("OPENAI_API_KEY is not set")
         
@@ -47,11 +75,14 @@ def create_openrouter_llm() -> ChatOpenAI:
         raise e
 
 
+@lru_cache(maxsize=1)
 def create_ollama_llm() -> ChatOllama:
     """
-    创建Ollama的ChatOllama实例
+    创建Ollama的ChatOllama实例（进程内复用，创建失败不缓存）
     """
     try:
+        from langchain_ollama import ChatOllama
+
         llm = ChatOllama(
             model=settings.OLLAMA_MODEL_NAME,
             temperature=settings.LLM_TEMPERATURE,
@@ -66,9 +97,10 @@ def create_ollama_llm() -> ChatOllama:
         raise e
 
 
+@lru_cache(maxsize=4)
 def get_llm(provider: Optional[str] = None) -> ChatOpenAI | ChatOllama:
     """
-    获取LLM实例，支持自动回退机制
+    获取LLM实例，支持自动回退机制；按 provider 缓存，同一进程内只创建一次客户端
     
     Args:
         provider: 指定提供商 ('openrouter', 'ollama', 'auto')
@@ -76,6 +108,7 @@ def get_llm(provider: Optional[str] = None) -> ChatOpenAI | ChatOllama:
     Returns:
         LLM实例
     """
+    init_llm_cache()
     if provider is None:
         provider = "auto"
     
@@ -0,0 +1,51 @@
+"""
+This module implements lightweight per-phase timing for the recommender nodes.
+"""
+
+import json
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from loguru import logger
+
+from src.config import settings
+
+
+@contextmanager
+def phase(name: str, timings: Optional[Dict[str, float]]) -> Iterator[None]:
+    """
+    Records the wall time of the enclosed block into `timings` as `t_<name>_ms`.
+
+    `timings` is a per-call dict (not thread-local) so async nodes interleaving
+    on one event loop thread don't mix up each other's phases; pass None to
+    skip timing.
+    """
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[f"t_{name}_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+
+def start_timings() -> Optional[Dict[str, float]]:
+    """
+    Returns a fresh timing dict when `RAG_PROFILE` is on, None otherwise.
+    """
+    if not settings.RAG_PROFILE:
+        return None
+    return {"_start": time.perf_counter()}
+
+
+def log_timings(node: str, timings: Optional[Dict[str, float]], **fields) -> None:
+    """
+    Emits one structured log line with all phase timings of a node call.
+    """
+    if timings is None:
+        return
+    start = timings.pop("_start")
+    record = {"node": node, **timings, "total_ms": round((time.perf_counter() - start) * 1000, 2), **fields}
+    logger.info(json.dumps(record, ensure_ascii=False))
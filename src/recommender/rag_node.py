@@ -2,31 +2,47 @@
 This module implements a RAG (Retrieval-Augmented Generation) pipeline for an LLM-based product recommender.
 """
 
-import os
-import sys
+import asyncio
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional, Tuple
 
-from langchain.globals import set_llm_cache
+import numpy as np
 from langchain.schema.output_parser import StrOutputParser
-from langchain_community.cache import InMemoryCache
-from langchain_core.runnables import RunnableLambda, RunnableParallel
 from loguru import logger
 
-# Local imports
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-
 from src.config import settings
 from src.recommender.state import RecState
 from src.recommender.utils import create_rag_template, extract_category_from_query, filter_docs_by_category, convert_docs_to_prompt
 from src.recommender.llm_factory import get_llm
+from src.recommender.profiling import log_timings, phase, start_timings
+
+_rag_chain_lock = threading.Lock()
+
+# 最终推荐结果的 LRU：相同查询 + 相同候选文档时直接返回，完全跳过 LLM 调用
+_RESPONSE_CACHE: "OrderedDict[ResponseKey, str]" = OrderedDict()
+_response_cache_lock = threading.Lock()
+
 
 def build_rag_chain():
     """
-    Builds and returns a RAG chain for product recommendations.
+    Returns the process-wide RAG chain, building it on first use.
+
+    The lock keeps concurrent first requests (the graph runs sync nodes in a
+    thread pool) from constructing the LLM client and chain more than once.
     """
-    # Set up in-memory caching for the LLM
-    set_llm_cache(InMemoryCache())
+    with _rag_chain_lock:
+        return _build_rag_chain_cached()
 
+
+@lru_cache(maxsize=1)
+def _build_rag_chain_cached():
+    """
+    Builds and returns a RAG chain for product recommendations.
+    """
     # Initialize the LLM using the factory
     llm = get_llm("auto")
 
@@ -36,82 +52,407 @@ def build_rag_chain():
     # Initialize the output parser
     parser = StrOutputParser()
 
-    # Define the RAG chain
-    rag_chain = (
-        RunnableParallel(
-            {
-                "docs": RunnableLambda(lambda x: x["docs"]),
-                "query": RunnableLambda(lambda x: x["query"]),
-            }
-        )
-        | prompt
-        | llm
-        | parser
-    )
+    # Define the RAG chain; the prompt consumes {"query", "docs"} directly
+    rag_chain = prompt | llm | parser
 
     return rag_chain
 
 
+def _prepare_rag_docs(state: RecState) -> Optional[list]:
+    """
+    Applies category filtering and the ranker hand-off rules to `state`.
+
+    Returns the documents to recommend from, or None when `state` is already
+    final or should continue to the ranker node.
+    """
+    query = state["query"]
+    docs = state.get("docs", [])
+    ranker_attempted = state.get("ranker_attempted", False)
+
+    # --------- 品类过滤逻辑 begin ---------
+    # category = extract_category_from_query(query)
+    # docs = filter_docs_by_category(docs, category)
+    # state["docs"] = docs
+    # --------- 品类过滤逻辑 end ---------
+    
+    # # 如果docs为空但有products，使用products
+    # if not docs and products:
+    #     logger.info("Using products from ranker_node for RAG recommendation")
+    #     rag_chain = build_rag_chain()
+    #     recommendation = rag_chain.invoke({
+    #         "query": query,
+    #         "docs": products
+    #     })
+    #     state["recommendation"] = recommendation
+    #     logger.info(f"Generated RAG recommendation for query: {query}")
+    #     return state
+    
+    # # 如果docs和products都为空，且还没有尝试过ranker，则跳转到ranker
+    # if not docs and not products and not ranker_attempted:
+    #     logger.info("No documents found, will try ranker node")
+    #     return state  # 让图流程继续到ranker节点
+
+    if not ranker_attempted:
+        category = extract_category_from_query(query)
+        docs = filter_docs_by_category(docs, category)
+        state["docs"] = docs
+        if len(docs) < settings.TOTAL_TOP_K:
+            logger.info(f"{len(docs)} documents found for RAG recommendation, will try ranker node")
+            return None
+    
+    # 如果经过ranker后仍然没有docs，才返回未找到
+    if not docs and ranker_attempted:
+        logger.warning("No documents or products found for RAG recommendation after trying ranker")
+        state["recommendation"] = "抱歉，我没有找到相关的产品信息。请尝试更具体的查询。"
+        return None
+
+    return docs
+
+
+class ResponseKey(NamedTuple):
+    """Cache key of one recommendation: the normalized query and a digest of the doc ids."""
+
+    query: str
+    docs: str
+
+
+def _response_cache_key(query: str, docs: list) -> ResponseKey:
+    """
+    Pairs the normalized query with a digest of the recommended document ids.
+
+    Document order is part of the digest because the prompt asks the LLM to
+    keep the products in the given order.
+    """
+    doc_keys = [
+        str(getattr(doc, "id", None) or doc.metadata.get("id") or doc.page_content[:64])
+        for doc in docs
+    ]
+    digest = hashlib.sha256(json.dumps(doc_keys, ensure_ascii=False).encode("utf-8")).hexdigest()
+    return ResponseKey(query.strip().lower(), digest)
+
+
+class SemanticResponseCache:
+    """
+    Redis vector index of past recommendations, shared across processes.
+
+    Only the user query is embedded (it fits well within MiniLM's 128-token
+    window, unlike a full serialized chat prompt), and every lookup is filtered
+    to the exact same document digest, so a hit only reuses an answer that was
+    written for the same products in the same order.
+    """
+
+    def __init__(self, redis_url: str, embeddings, distance_threshold: float, index_name: str = "rag_response_cache"):
+        import redis
+
+        # 固定 RESP2：FT.SEARCH 的回包在各 redis-py 版本中都解析为同一 Result 结构
+        self._client = redis.Redis.from_url(redis_url, protocol=2)
+        self._embeddings = embeddings
+        self._distance_threshold = distance_threshold
+        self._index_name = index_name
+        self._prefix = f"{index_name}:"
+        self._ensure_index()
+
+    def _ensure_index(self) -> None:
+        import redis
+        from redis.commands.search.field import TagField, VectorField
+        from redis.commands.search.index_definition import IndexDefinition, IndexType
+
+        index = self._client.ft(self._index_name)
+        try:
+            index.info()
+            return
+        except redis.ResponseError:
+            pass
+
+        # response 字段不进索引，命中后通过 RETURN 直接从 hash 读取
+        dim = len(self._embeddings.embed_query("dimension probe"))
+        index.create_index(
+            [
+                TagField("docs"),
+                VectorField("embedding", "FLAT", {"TYPE": "FLOAT32", "DIM": dim, "DISTANCE_METRIC": "COSINE"}),
+            ],
+            definition=IndexDefinition(prefix=[self._prefix], index_type=IndexType.HASH),
+        )
+        logger.info(f"Created Redis semantic response cache index {self._index_name} (dim={dim})")
+
+    def _vector(self, query: str) -> bytes:
+        return np.asarray(self._embeddings.embed_query(query), dtype=np.float32).tobytes()
+
+    def lookup(self, key: ResponseKey) -> Optional[str]:
+        from redis.commands.search.query import Query
+
+        # docs 是十六进制摘要，无需 TAG 转义
+        query = (
+            Query(f"(@docs:{{{key.docs}}})=>[KNN 1 @embedding $vec AS distance]")
+            .sort_by("distance")
+            .return_fields("response", "distance")
+            .paging(0, 1)
+            .dialect(2)
+        )
+        result = self._client.ft(self._index_name).search(query, query_params={"vec": self._vector(key.query)})
+        if result.docs and float(result.docs[0].distance) <= self._distance_threshold:
+            return result.docs[0].response
+        return None
+
+    def update(self, key: ResponseKey, recommendation: str) -> None:
+        entry_id = hashlib.sha256(f"{key.docs}:{key.query}".encode("utf-8")).hexdigest()
+        self._client.hset(
+            self._prefix + entry_id,
+            mapping={"docs": key.docs, "response": recommendation, "embedding": self._vector(key.query)},
+        )
+
+
+@lru_cache(maxsize=1)
+def _get_semantic_cache() -> Optional[SemanticResponseCache]:
+    """Connects the Redis semantic cache once per process; None when disabled or unreachable."""
+    if not settings.REDIS_URL:
+        return None
+    try:
+        from src.recommender.lightweight_models import get_lightweight_embeddings
+
+        cache = SemanticResponseCache(
+            redis_url=settings.REDIS_URL,
+            embeddings=get_lightweight_embeddings(),
+            distance_threshold=settings.RAG_SEMANTIC_CACHE_THRESHOLD,
+        )
+        logger.info("Using Redis semantic cache for RAG recommendations")
+        return cache
+    except Exception as e:
+        logger.warning(f"Failed to set up Redis semantic cache, using the in-process cache only: {e}")
+        return None
+
+
+def _remember_response(key: ResponseKey, recommendation: str) -> None:
+    with _response_cache_lock:
+        _RESPONSE_CACHE[key] = recommendation
+        _RESPONSE_CACHE.move_to_end(key)
+        while len(_RESPONSE_CACHE) > settings.RAG_RESPONSE_CACHE_SIZE:
+            _RESPONSE_CACHE.popitem(last=False)
+
+
+def _get_cached_response(key: ResponseKey) -> Optional[str]:
+    """Looks `key` up in the in-process LRU first, then in the Redis semantic cache."""
+    with _response_cache_lock:
+        recommendation = _RESPONSE_CACHE.get(key)
+        if recommendation is not None:
+            _RESPONSE_CACHE.move_to_end(key)
+            return recommendation
+
+    semantic_cache = _get_semantic_cache()
+    if semantic_cache is None:
+        return None
+    try:
+        recommendation = semantic_cache.lookup(key)
+    except Exception as e:
+        logger.warning(f"Semantic response cache lookup failed: {e}")
+        return None
+    if recommendation is not None:
+        _remember_response(key, recommendation)
+    return recommendation
+
+
+def _set_cached_response(key: ResponseKey, recommendation: str) -> None:
+    _remember_response(key, recommendation)
+    semantic_cache = _get_semantic_cache()
+    if semantic_cache is None:
+        return
+    try:
+        semantic_cache.update(key, recommendation)
+    except Exception as e:
+        logger.warning(f"Semantic response cache update failed: {e}")
+
+
+class BatchedRagExecutor:
+    """
+    Coalesces concurrent async RAG requests into `abatch` calls.
+
+    The first request starts a short collection window; everything queued
+    within it (up to `max_batch` items) is sent as one batch and the results
+    are fanned back to the waiting callers.
+
+    Queue and worker task are kept per running event loop: asyncio primitives
+    are bound to the loop that created them, so a second loop (tests, a new
+    `asyncio.run`, another uvicorn worker thread) gets its own pair.
+    """
+
+    def __init__(self, batch_window_ms: int, max_batch: int):
+        self.batch_window_ms = batch_window_ms
+        self.max_batch = max_batch
+        self._workers: Dict[asyncio.AbstractEventLoop, Tuple[asyncio.Queue, asyncio.Task]] = {}
+
+    def _get_queue(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        # 清理已关闭事件循环遗留的条目，避免长期持有
+        for stale in [l for l in self._workers if l.is_closed()]:
+            del self._workers[stale]
+
+        entry = self._workers.get(loop)
+        if entry is None or entry[1].done():
+            queue: asyncio.Queue = asyncio.Queue()
+            entry = (queue, loop.create_task(self._run(queue)))
+            self._workers[loop] = entry
+        return entry[0]
+
+    async def submit(self, chain_input: dict) -> str:
+        """Queues one chain input and waits for its recommendation."""
+        queue = self._get_queue()
+        future = asyncio.get_running_loop().create_future()
+        await queue.put((chain_input, future))
+        return await future
+
+    async def _run(self, queue: asyncio.Queue) -> None:
+        while True:
+            batch = [await queue.get()]
+            await asyncio.sleep(self.batch_window_ms / 1000)
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            try:
+                results = await build_rag_chain().abatch(
+                    [chain_input for chain_input, _ in batch],
+                    config={"max_concurrency": self.max_batch},
+                    return_exceptions=True,
+                )
+            except Exception as e:
+                results = [e] * len(batch)
+
+            for (_, future), result in zip(batch, results):
+                # 调用方已取消时跳过
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            logger.info(f"Processed batched RAG request of size {len(batch)}")
+
+
+_batched_executor = BatchedRagExecutor(
+    batch_window_ms=settings.RAG_BATCH_WINDOW_MS, max_batch=settings.RAG_MAX_BATCH
+)
+
+
+def _begin_rag(state: RecState, timings: Optional[dict] = None) -> Optional[Tuple[ResponseKey, dict]]:
+    """
+    Runs the steps every RAG entry point shares before the LLM call: category
+    filtering / ranker hand-off, then the response cache lookup.
+
+    Returns `(cache_key, chain_input)` when the LLM has to be called, or None
+    when `state` is already final (cache hit, nothing found) or should continue
+    to the ranker node.
+    """
+    with phase("filter", timings):
+        docs = _prepare_rag_docs(state)
+    if docs is None:
+        return None
+
+    query = state["query"]
+    cache_key = _response_cache_key(query, docs)
+    recommendation = _get_cached_response(cache_key)
+    if recommendation is not None:
+        logger.info(f"Serving cached recommendation for query: {query}")
+        state["recommendation"] = recommendation
+        return None
+    return cache_key, {"query": query, "docs": convert_docs_to_prompt(docs)}
+
+
+def _finish_rag(state: RecState, cache_key: ResponseKey, recommendation: str) -> None:
+    """Stores a freshly generated recommendation in the cache and in `state`."""
+    _set_cached_response(cache_key, recommendation)
+    state["recommendation"] = recommendation
+    logger.info(f"Generated recommendation for query: {state['query']}")
+
+
+def _fail_rag(state: RecState, error: BaseException) -> None:
+    state["recommendation"] = f"抱歉，生成推荐时出现错误: {str(error)}"
+
+
 def rag_recommender(state: RecState) -> RecState:
     """
     Generates recommendations using RAG (Retrieval-Augmented Generation).
     """
+    timings = start_timings()
     try:
-        query = state["query"]
-        docs = state.get("docs", [])
-        ranker_attempted = state.get("ranker_attempted", False)
-
-        # --------- 品类过滤逻辑 begin ---------
-        # category = extract_category_from_query(query)
-        # docs = filter_docs_by_category(docs, category)
-        # state["docs"] = docs
-        # --------- 品类过滤逻辑 end ---------
-        
-        # # 如果docs为空但有products，使用products
-        # if not docs and products:
-        #     logger.info("Using products from ranker_node for RAG recommendation")
-        #     rag_chain = build_rag_chain()
-        #     recommendation = rag_chain.invoke({
-        #         "query": query,
-        #         "docs": products
-        #     })
-        #     state["recommendation"] = recommendation
-        #     logger.info(f"Generated RAG recommendation for query: {query}")
-        #     return state
-        
-        # # 如果docs和products都为空，且还没有尝试过ranker，则跳转到ranker
-        # if not docs and not products and not ranker_attempted:
-        #     logger.info("No documents found, will try ranker node")
-        #     return state  # 让图流程继续到ranker节点
-
-        if not ranker_attempted:
-            category = extract_category_from_query(query)
-            docs = filter_docs_by_category(docs, category)
-            state["docs"] = docs
-            if len(docs) < settings.TOTAL_TOP_K:
-                logger.info(f"{len(docs)} documents found for RAG recommendation, will try ranker node")
-                return state
-        
-        # 如果经过ranker后仍然没有docs，才返回未找到
-        if not docs and ranker_attempted:
-            logger.warning("No documents or products found for RAG recommendation after trying ranker")
-            state["recommendation"] = "抱歉，我没有找到相关的产品信息。请尝试更具体的查询。"
+        pending = _begin_rag(state, timings)
+        if pending is None:
             return state
 
-        # Build the RAG chain
-        rag_chain = build_rag_chain()
-        
-        # Generate recommendation
-        recommendation = rag_chain.invoke({
-            "query": query,
-            "docs": convert_docs_to_prompt(docs)
-        })
-        
-        state["recommendation"] = recommendation
-        logger.info(f"Generated recommendation for query: {query}")
-        
+        cache_key, chain_input = pending
+        with phase("llm", timings):
+            recommendation = build_rag_chain().invoke(chain_input)
+        _finish_rag(state, cache_key, recommendation)
+
     except Exception as e:
         logger.exception("Error in recommendation")
-        state["recommendation"] = f"抱歉，生成推荐时出现错误: {str(e)}"
-    
+        _fail_rag(state, e)
+    finally:
+        log_timings("rag", timings, top_k=settings.TOTAL_TOP_K, n_docs=len(state.get("docs") or []))
+
+    return state
+
+
+async def _run_cache_io(func, *args):
+    # 语义缓存需要查询向量化 + Redis 往返，异步节点中放到线程池执行，避免阻塞事件循环
+    if settings.REDIS_URL:
+        return await asyncio.to_thread(func, *args)
+    return func(*args)
+
+
+async def arag_recommender(state: RecState) -> RecState:
+    """
+    Async variant of `rag_recommender`: awaits the LLM call so the event loop
+    can serve other requests while generation is in flight.
+    """
+    timings = start_timings()
+    try:
+        pending = await _run_cache_io(_begin_rag, state, timings)
+        if pending is None:
+            return state
+
+        cache_key, chain_input = pending
+        with phase("llm", timings):
+            if settings.RAG_BATCHING_ENABLED:
+                recommendation = await _batched_executor.submit(chain_input)
+            else:
+                recommendation = await build_rag_chain().ainvoke(chain_input)
+        await _run_cache_io(_finish_rag, state, cache_key, recommendation)
+
+    except Exception as e:
+        logger.exception("Error in recommendation")
+        _fail_rag(state, e)
+    finally:
+        log_timings("rag", timings, top_k=settings.TOTAL_TOP_K, n_docs=len(state.get("docs") or []))
+
     return state
+
+
+def rag_recommender_batch(states: list[RecState]) -> list[RecState]:
+    """
+    Generates recommendations for several states with one concurrent `batch` call.
+    """
+    pending = []
+    for state in states:
+        try:
+            begun = _begin_rag(state)
+        except Exception as e:
+            logger.exception("Error in recommendation")
+            _fail_rag(state, e)
+            continue
+        if begun is not None:
+            pending.append((state, *begun))
+
+    if pending:
+        recommendations = build_rag_chain().batch(
+            [chain_input for _, _, chain_input in pending],
+            config={"max_concurrency": settings.LLM_BATCH_MAX_CONCURRENCY},
+            return_exceptions=True,
+        )
+        for (state, cache_key, _), recommendation in zip(pending, recommendations):
+            if isinstance(recommendation, Exception):
+                logger.error(f"Error in recommendation: {recommendation}")
+                _fail_rag(state, recommendation)
+            else:
+                _finish_rag(state, cache_key, recommendation)
+        logger.info(f"Generated {len(pending)} batched recommendations")
+
+    return states
@@ -2,26 +2,28 @@
 This module implements an cross encoder ranker node for product recommender.
 """
 
-import os
+from __future__ import annotations
+
 import pickle
-import sys
-from typing import List
+from functools import lru_cache
+from itertools import islice
+from typing import TYPE_CHECKING, List
 
 from langchain.schema import Document
-from langchain_huggingface import HuggingFaceEmbeddings
 from loguru import logger
 
-# local imports
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+if TYPE_CHECKING:
+    from langchain_huggingface import HuggingFaceEmbeddings
 
 from src.config import settings
+from src.recommender.profiling import log_timings, phase, start_timings
 from src.recommender.state import RecState
 from src.recommender.utils import filter_docs_by_category, extract_category_from_query
 
 
+@lru_cache(maxsize=1)
 def load_cross_encoder_model() -> HuggingFaceEmbeddings:
-    """Load pickle locally saved cross-encoder model."""
+    """Load pickle locally saved cross-encoder model (once per process)."""
     try:
         with open(settings.CROSS_ENCODER_RERANKER_PATH, "rb") as f:
             cross_encoder = pickle.load(f)
@@ -32,7 +34,7 @@ def load_cross_encoder_model() -> HuggingFaceEmbeddings:
         raise e
 
 
-def build_ranker(query: str):
+def build_ranker(query: str, timings: dict | None = None):
     """
     cross encoder retriever.
     """
@@ -41,11 +43,14 @@ def build_ranker(query: str):
     # def format_docs(docs: List[Document]):
     #     return "\n\n".join([f"- {doc.page_content}" for doc in docs])
 
-    product_docs = cross_encoder.invoke(query)
+    # 混合检索（含查询向量化）与 cross-encoder 重排在同一次 invoke 中完成
+    with phase("rerank", timings):
+        product_docs = cross_encoder.invoke(query)
     logger.info(f"ranker: Retrieved {len(product_docs)} documents.")
 
-    category = extract_category_from_query(query)
-    docs = filter_docs_by_category(product_docs, category)
+    with phase("filter", timings):
+        category = extract_category_from_query(query)
+        docs = filter_docs_by_category(product_docs, category)
     return docs
 
 
@@ -53,9 +58,13 @@ def ranker_node(state: RecState) -> RecState:
     """
     Ranker node.
     """
+    timings = start_timings()
     query = state["query"]
-    docs = build_ranker(query)
+    docs = build_ranker(query, timings)
     margin = settings.TOTAL_TOP_K - len(state["docs"])
-    state["docs"].extend(docs[:margin])
+    # margin <= 0 时 docs[:margin] 会截出负索引切片，误追加文档
+    if margin > 0:
+        state["docs"].extend(islice(docs, margin))
     state["ranker_attempted"] = True
+    log_timings("ranker", timings, top_k=settings.TOTAL_TOP_K, n_docs=len(state["docs"]))
     return state
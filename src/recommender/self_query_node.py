@@ -2,27 +2,27 @@
 This module contains the self-query retriever node, which retrieves products using the self-query retriever.
 """
 
-import os
-import sys
+from __future__ import annotations
+
 from functools import lru_cache
-from typing import List
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
 from langchain.chains.query_constructor.base import load_query_constructor_runnable
 from langchain.retrievers import SelfQueryRetriever
 from langchain.schema import Document
-from langchain_chroma import Chroma
 from langchain_core.runnables import RunnableLambda
-from langchain_huggingface import HuggingFaceEmbeddings
 from loguru import logger
 from tenacity import retry, stop_after_attempt, wait_fixed
 
-# Local imports
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+if TYPE_CHECKING:
+    # 仅用于类型标注；torch / chromadb 在首次初始化模型、加载索引时才导入
+    from langchain_chroma import Chroma
+    from langchain_huggingface import HuggingFaceEmbeddings
 
 from src.config import settings
+from src.recommender.profiling import log_timings, phase, start_timings
 from src.recommender.state import RecState
-from src.recommender.utils import CustomChromaTranslator, get_metadata_info
+from src.recommender.utils import CustomChromaTranslator, category_flag_key, extract_category_from_query, get_metadata_info
 from src.recommender.llm_factory import get_llm
 
 
@@ -31,6 +31,8 @@ from src.recommender.llm_factory import get_llm
 def initialize_embeddings_model() -> HuggingFaceEmbeddings:
     """Initializes the HuggingFace embeddings model with retries and caching."""
     try:
+        from langchain_huggingface import HuggingFaceEmbeddings
+
         embeddings = HuggingFaceEmbeddings(model_name=settings.EMBEDDINGS_MODEL_PATH)
         logger.info(f"Successfully initialized embeddings model: {settings.EMBEDDINGS_MODEL_NAME}")
         return embeddings
@@ -39,11 +41,21 @@ def initialize_embeddings_model() -> HuggingFaceEmbeddings:
         raise e
 
 
+# HuggingFaceEmbeddings 是 pydantic 模型，不可哈希，无法直接用 lru_cache；
+# 按对象 id 缓存，并持有 embeddings 引用防止 id 被复用
+_chroma_indexes: dict = {}
+
+
 def load_chroma_index(embeddings: HuggingFaceEmbeddings) -> Chroma:
     """
     Load the chroma index with caching.
     """
+    cached = _chroma_indexes.get(id(embeddings))
+    if cached is not None:
+        return cached[1]
     try:
+        from langchain_chroma import Chroma
+
         logger.info("Loading the chroma index...")
         vectorstore = Chroma(
             collection_name="product_collection",
@@ -54,31 +66,63 @@ def load_chroma_index(embeddings: HuggingFaceEmbeddings) -> Chroma:
         logger.info(
             f"Number of documents in Chroma index: {vectorstore._collection.count()}"
         )
+        _chroma_indexes[id(embeddings)] = (embeddings, vectorstore)
         return vectorstore
     except Exception as e:
         logger.exception("Failed to load the chroma index.")
         raise e
 
 
-def build_self_query_chain(vectorstore: Chroma) -> RunnableLambda:
+@lru_cache(maxsize=4)
+def build_query_constructor(provider: str = "auto"):
     """
-    Returns a chain (RunnableLambda) that, given {"query": ...}, uses a SelfQueryRetriever
-    to fetch documents with advanced filtering. If no docs are found, it will return an empty list.
+    Builds the query-constructor chain once per LLM provider; the few-shot
+    prompt it renders from the metadata schema is static.
     """
     # 使用新的LLM工厂获取LLM实例
-    llm = get_llm("auto")
+    llm = get_llm(provider)
 
     attribute_info, doc_contents = get_metadata_info()
 
-    # Build the query-constructor chain
-    query_constructor = load_query_constructor_runnable(
+    return load_query_constructor_runnable(
         llm=llm,
         document_contents=doc_contents,
         attribute_info=attribute_info,
     )
 
+
+class CategoryFilteredSelfQueryRetriever(SelfQueryRetriever):
+    """
+    SelfQueryRetriever that ANDs `category_filter` into the metadata filter the
+    query constructor produces; SelfQueryRetriever itself would let the
+    structured filter overwrite a `filter` given in search_kwargs.
+    """
+
+    category_filter: Optional[Dict[str, Any]] = None
+
+    def _prepare_query(self, query, structured_query) -> Tuple[str, Dict[str, Any]]:
+        new_query, search_kwargs = super()._prepare_query(query, structured_query)
+        if self.category_filter:
+            structured_filter = search_kwargs.get("filter")
+            search_kwargs["filter"] = (
+                {"$and": [structured_filter, self.category_filter]}
+                if structured_filter
+                else self.category_filter
+            )
+        return new_query, search_kwargs
+
+
+@lru_cache(maxsize=1)
+def build_self_query_chain(vectorstore: Chroma) -> RunnableLambda:
+    """
+    Returns a chain (RunnableLambda) that, given {"query": ...}, uses a SelfQueryRetriever
+    to fetch documents with advanced filtering. If no docs are found, it will return an empty list.
+    """
+    # Build the query-constructor chain
+    query_constructor = build_query_constructor("auto")
+
     # Create a SelfQueryRetriever (LangChain v0.3.x 新接口)
-    retriever = SelfQueryRetriever(
+    retriever = CategoryFilteredSelfQueryRetriever(
         query_constructor=query_constructor,
         vectorstore=vectorstore,  # 新版要求直接传入底层 VectorStore
         structured_query_translator=CustomChromaTranslator(),
@@ -91,12 +135,25 @@ def build_self_query_chain(vectorstore: Chroma) -> RunnableLambda:
         """
         Retrieves documents using self-query retriever.
         """
+        timings = start_timings()
         try:
             query = state["query"]
             logger.info(f"Self-query retrieving for: {query}")
 
+            # 查询中含品类词时，让 Chroma 在向量检索前按入库时打的品类标记预过滤，
+            # 避免 top-k 名额被其他品类占用、再在下游被过滤掉；
+            # 不按文档内容子串过滤，page_content 中的品牌 / 尺码等文本会误命中
+            active_retriever = retriever
+            category = extract_category_from_query(query)
+            if category:
+                active_retriever = retriever.model_copy(
+                    update={"category_filter": {category_flag_key(category): True}}
+                )
+
             # Get documents from the retriever
-            docs = retriever.get_relevant_documents(query)
+            # 查询构造（LLM）、查询向量化与 Chroma 检索均在这一次调用中完成
+            with phase("search", timings):
+                docs = active_retriever.invoke(query)
 
             if docs:
                 logger.info(f"Found {len(docs)} documents using self-query retriever")
@@ -109,6 +166,7 @@ def build_self_query_chain(vectorstore: Chroma) -> RunnableLambda:
             logger.exception("Error in self-query retrieval")
             state["docs"] = []
 
+        log_timings("self_query", timings, top_k=settings.TOTAL_TOP_K, n_docs=len(state["docs"]))
         return state
 
     return RunnableLambda(self_query_retrieve)
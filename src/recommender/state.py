@@ -31,3 +31,21 @@ class RecState(TypedDict):
     self_query_state: str
     docs: list
     ranker_attempted: bool
+
+
+# 默认初始状态；每次请求浅拷贝，并为可变的 docs 单独新建列表
+_INITIAL_STATE = {
+    "query": "",
+    "on_topic": False,  # 默认值，会被check_topic节点更新
+    "recommendation": "",  # 默认空字符串
+    "self_query_state": "",  # 默认空字符串
+    "docs": [],  # 默认空列表
+    "ranker_attempted": False,  # 默认False，表示还没有尝试过ranker
+}
+
+
+def initial_state(query: str) -> RecState:
+    """
+    Builds the state a graph run starts from for `query`.
+    """
+    return {**_INITIAL_STATE, "query": query, "docs": []}
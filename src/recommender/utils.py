@@ -3,6 +3,9 @@ This module contains utility functions for the recommender service.
 """
 
 import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from types import MappingProxyType
 from langchain.prompts import PromptTemplate
 from langchain_community.query_constructors.chroma import (
     ChromaTranslator as BaseChromaTranslator,
@@ -10,11 +13,14 @@ from langchain_community.query_constructors.chroma import (
 from langchain_core.structured_query import Comparator, Comparison
 from loguru import logger
 import json
-import requests
-import ast
+import orjson
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 
 from src.config import settings
 
+# 中文字符（CJK 统一表意文字基本区）检测，模块级编译一次
+_CJK_RE = re.compile(r'[\u4e00-\u9fff]')
+
 
 def detect_language(text: str) -> str:
     """
@@ -27,10 +33,31 @@ def detect_language(text: str) -> str:
         'zh' if Chinese characters are detected, 'en' otherwise
     """
     # Check for Chinese characters (Unicode range for Chinese)
-    chinese_pattern = re.compile(r'[\u4e00-\u9fff]')
-    if chinese_pattern.search(text):
-        return 'zh'
-    return 'en'
+    return 'zh' if _CJK_RE.search(text) else 'en'
+
+
+# 各类固定回复文案，模块级只读常量，避免每次调用都重建字典
+_RESPONSES = MappingProxyType({
+    'error': {
+        'en': "I'm sorry, I can't help with that. Please ask a query related to product recommendations.",
+        'zh': "抱歉，我无法帮助您解决这个问题。请询问与产品推荐相关的查询。"
+    },
+    'thinking': {
+        'en': "🤖 Thinking...",
+        'zh': "🤖 正在思考..."
+    },
+    'no_recommendation': {
+        'en': "No recommendation found for your request.",
+        'zh': "没有找到适合您需求的推荐。"
+    }
+})
+
+
+@lru_cache(maxsize=None)
+def _resp(language: str, response_type: str) -> str:
+    # 未知的 response_type 回退到通用错误文案，而不是抛 KeyError
+    bucket = _RESPONSES.get(response_type) or _RESPONSES['error']
+    return bucket.get(language, bucket['en'])
 
 
 def get_language_specific_response(query: str, response_type: str = "error") -> str:
@@ -44,36 +71,17 @@ def get_language_specific_response(query: str, response_type: str = "error") ->
     Returns:
         Language-specific response string
     """
-    language = detect_language(query)
-    
-    responses = {
-        'error': {
-            'en': "I'm sorry, I can't help with that. Please ask a query related to product recommendations.",
-            'zh': "抱歉，我无法帮助您解决这个问题。请询问与产品推荐相关的查询。"
-        },
-        'thinking': {
-            'en': "🤖 Thinking...",
-            'zh': "🤖 正在思考..."
-        },
-        'no_recommendation': {
-            'en': "No recommendation found for your request.",
-            'zh': "没有找到适合您需求的推荐。"
-        }
-    }
-    
-    return responses.get(response_type, {}).get(language, responses[response_type]['en'])
+    return _resp(detect_language(query), response_type)
+
+
+_SKIP_COMPARATORS = frozenset({Comparator.LIKE, Comparator.CONTAIN})
 
 
 class CustomChromaTranslator(BaseChromaTranslator):
-    def __init__(self):
-        super().__init__()
-        # `allowed_comparators` is a list; convert to set, then add `LIKE` and `CONTAIN`, then back to list
-        if self.allowed_comparators is None:
-            self.allowed_comparators = []
-        allowed_comparator_set = set(self.allowed_comparators)
-        allowed_comparator_set.add(Comparator.LIKE)
-        allowed_comparator_set.add(Comparator.CONTAIN)
-        self.allowed_comparators = list(allowed_comparator_set)
+    # 比较符集合是静态的，类定义时一次性算好：基类允许的比较符再加上 `LIKE` 与 `CONTAIN`
+    allowed_comparators = list(
+        set(BaseChromaTranslator.allowed_comparators or []) | _SKIP_COMPARATORS
+    )
 
     def visit_comparison(self, comparison: Comparison):
         """
@@ -81,7 +89,7 @@ class CustomChromaTranslator(BaseChromaTranslator):
         For size matching, we'll skip the filter since ChromaDB doesn't support substring matching.
         This will allow semantic search to work while avoiding the filtering error.
         """
-        if comparison.comparator == Comparator.LIKE or comparison.comparator == Comparator.CONTAIN:
+        if comparison.comparator in _SKIP_COMPARATORS:
             # Skip size filtering for now since ChromaDB doesn't support substring matching
             # This will allow the query to proceed with semantic search only
             return None
@@ -118,8 +126,8 @@ def get_metadata_info():
     return ATTRIBUTE_INFO, DOC_CONTENT
 
 
-def create_rag_template():
-    prompt_template = """你是一个时尚穿搭领域的智能购物助手。你刚刚根据用户需求找到了一些可用的产品，正在向用户介绍这些服装产品。
+# 提示词模板在导入时构建一次，避免每次构建 RAG 链都重新解析模板
+_RAG_PROMPT_STR = """你是一个时尚穿搭领域的智能购物助手。你刚刚根据用户需求找到了一些可用的产品，正在向用户介绍这些服装产品。
 
     用户正在寻找与以下内容相关的产品：**{query}**
 
@@ -143,16 +151,53 @@ def create_rag_template():
     如果您需要更多详细信息或替代方案，请告诉我！"
     """
 
-    prompt = PromptTemplate(template=prompt_template, input_variables=["docs", "query"])
-    return prompt
+_RAG_PROMPT = PromptTemplate(template=_RAG_PROMPT_STR, input_variables=["docs", "query"])
+
+
+def create_rag_template():
+    return _RAG_PROMPT
 
 CATEGORY_KEYWORDS = ["裙", "裤", "衬衫", "T恤", "夹克", "外套", "背心"]
+# 所有品类关键词编译成一个交替正则，对查询只扫描一遍
+_CATEGORY_RE = re.compile("|".join(map(re.escape, CATEGORY_KEYWORDS)))
 
 def extract_category_from_query(query):
-    for cat in CATEGORY_KEYWORDS:
-        if cat in query:
-            return cat
-    return None
+    match = _CATEGORY_RE.search(query)
+    return match.group(0) if match else None
+
+def tag_categories(text):
+    """入库时计算文本命中的品类，逗号拼接（Chroma metadata 只支持标量）"""
+    return ",".join(sorted(set(_CATEGORY_RE.findall(text or ""))))
+
+
+@lru_cache(maxsize=4096)
+def _details_from_page_content(page_content):
+    """按 page_content 文本缓存 JSON 解析结果；以内容本身为键，文档被复制、反序列化或修改后不会读到旧值"""
+    try:
+        return json.loads(page_content).get("Product Details", "")
+    except (json.JSONDecodeError, AttributeError):
+        # 如果解析失败，使用原始 page_content
+        return page_content
+
+
+def extract_details_from_doc(doc):
+    """
+    Returns the product details text of a document: the "Product Details"
+    metadata when present, otherwise the field from its JSON page_content
+    (parsed once per distinct content).
+    """
+    details = ""
+    if hasattr(doc, "metadata") and isinstance(doc.metadata, dict):
+        details = doc.metadata.get("Product Details", "")
+    if not details and hasattr(doc, "page_content"):
+        # 尝试从 page_content 的 JSON 中提取 Product Details
+        details = _details_from_page_content(doc.page_content)
+    return details
+
+
+def category_flag_key(category):
+    """入库时为每个命中品类写入的布尔 metadata 键，供 Chroma where 精确过滤"""
+    return f"category_{category}"
 
 def filter_docs_by_category(docs, category):
     if not category:
@@ -160,21 +205,17 @@ def filter_docs_by_category(docs, category):
     filtered = []
     logger.info(f"Filtering docs by category: {category}")
     for doc in docs:
-        details = ""
-        if hasattr(doc, "metadata") and isinstance(doc.metadata, dict):
-            details = doc.metadata.get("Product Details", "")
-        if not details and hasattr(doc, "page_content"):
-            # 尝试从 page_content 的 JSON 中提取 Product Details
-            try:
-                import json
-                content_dict = json.loads(doc.page_content)
-                details = content_dict.get("Product Details", "")
-            except (json.JSONDecodeError, AttributeError):
-                # 如果解析失败，使用原始 page_content
-                details = doc.page_content
-        logger.info(f"Details: {details}")
-        if category in details:
+        # 优先使用入库时预计算的品类标签，避免每次查询重新扫描商品描述
+        categories = doc.metadata.get("categories") if isinstance(getattr(doc, "metadata", None), dict) else None
+        if categories is not None:
+            if category in categories.split(","):
+                filtered.append(doc)
+            continue
+
+        if category in extract_details_from_doc(doc):
             filtered.append(doc)
+    # 不再逐条打印商品详情；仅输出一条汇总，loguru 在 debug 关闭时不会格式化参数
+    logger.debug("Category filter {}: kept {}/{} docs", category, len(filtered), len(docs))
     return filtered
 
 def convert_item_to_page_content(item):
@@ -184,35 +225,105 @@ def convert_item_to_page_content(item):
         "Product Price": item["price"],
         "Available Sizes": ", ".join([variation["sizeName"] for variation in item["variations"]]),
     }
-    return json.dumps(page_content_dict, indent=2, ensure_ascii=False)
+    # 不使用 indent，json 才会走 C 实现的编码器（indent 会退回纯 Python 编码路径）
+    return json.dumps(page_content_dict, ensure_ascii=False)
+
+
+def _is_retryable_fetch_error(exc: BaseException) -> bool:
+    """只重试连接失败、超时与 5xx；4xx（如 404）重试也不会成功"""
+    import requests
+
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    return (
+        isinstance(exc, requests.HTTPError)
+        and exc.response is not None
+        and exc.response.status_code >= 500
+    )
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=0.5, max=4),
+    retry=retry_if_exception(_is_retryable_fetch_error),
+    reraise=True,
+)
+def _fetch_product_detail(session, url):
+    # (连接超时, 读取超时)：单个卡住的后端不会拖住整个加载过程
+    response = session.get(url, timeout=(3.05, 10))
+    response.raise_for_status()  # 检查请求是否成功
+    # 直接从字节解析，省去 bytes -> str 解码再解析的一次完整拷贝
+    return orjson.loads(response.content)
+
+
+def _fetch_product_detail_or_none(session, url):
+    import requests
+
+    try:
+        return _fetch_product_detail(session, url)
+    except (requests.RequestException, ValueError) as e:
+        # ValueError 覆盖 orjson.JSONDecodeError：返回 200 但 body 不是 JSON 时同样只跳过该商品
+        logger.error(f"请求失败: {url}: {e}")
+        return None
 
 
 def get_product_details():
+    # 仅离线抓取商品数据时才需要 requests，延迟导入以减轻服务端的导入开销
+    import requests
+
     base_url = "https://cloudawn3d.com/mall/getProductDetail/"
     out_path = settings.PROCESSED_DATA_PATH
 
+    database = []
+    logger.info(f"Fetching product details from database...")
+    # 复用同一个 Session 的连接池（keep-alive），并发拉取 12 个商品详情；map 保持原有顺序
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=12) as executor:
+        results = list(executor.map(lambda i: _fetch_product_detail_or_none(session, base_url + str(i)), range(1, 13)))
+    # 单个商品重试后仍失败时跳过，不影响其余商品
+    for response_text in results:
+        if response_text and "data" in response_text:
+            database.append(response_text["data"])
+    if not database:
+        logger.error("Failed to fetch any product details")
+        return None
+    logger.info(f"loaded {len(database)} items")
+    # orjson 在 C 层序列化并直接输出 UTF-8 字节（等价于 ensure_ascii=False），一次写入
+    with open(out_path, "wb") as f:
+        f.write(orjson.dumps(database, option=orjson.OPT_INDENT_2))
+    return database
+
+
+@lru_cache(maxsize=4096)
+def _parse_variations(raw: str):
+    """
+    Parses a stored `variations` string: JSON for current indexes, Python repr
+    (written by older indexing runs) as a fallback. Memoized per string, so
+    callers must not mutate the result.
+    """
     try:
-        database = []
-        logger.info(f"Fetching product details from database...")
-        for i in range(1,13):
-            response = requests.get(base_url + str(i))
-            response.raise_for_status()  # 检查请求是否成功
-            response_text = json.loads(response.text)
-            if "data" in response_text:
-                database.append(response_text["data"])
-        logger.info(f"loaded {len(database)} items")
-        with open(out_path, "w", encoding="utf-8") as f:
-            json.dump(database, f, ensure_ascii=False, indent=4)
-    except requests.RequestException as e:
-        logger.error(f"请求失败: {e}") 
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        import ast
+
+        return ast.literal_eval(raw)
 
 
 def convert_docs_to_prompt(docs):
-    prompt = ""
+    # 逐行收集后一次 join，避免循环中反复 += 拼接字符串
+    lines = []
     for doc in docs:
-        available_sizes = ", ".join([variation["sizeName"] for variation in ast.literal_eval(doc.metadata["variations"])])
-        prompt += f"产品名称: \"{doc.metadata['productName']}\", 颜色: {ast.literal_eval(doc.metadata["variations"])[0]['colorName']}, 价格: {doc.metadata['price']}, 可用尺码: {available_sizes}\n"
-    return prompt
+        metadata = doc.metadata
+        if "sizes_csv" in metadata and "first_color" in metadata:
+            # 新索引在入库时已展开尺码与颜色，直接读取
+            available_sizes = metadata["sizes_csv"]
+            color = metadata["first_color"]
+        else:
+            # 旧索引：variations 每个文档只解析一次，尺码与颜色共用
+            variations = _parse_variations(metadata["variations"])
+            available_sizes = ", ".join(variation["sizeName"] for variation in variations)
+            color = variations[0]['colorName']
+        lines.append(f"产品名称: \"{metadata['productName']}\", 颜色: {color}, 价格: {metadata['price']}, 可用尺码: {available_sizes}\n")
+    return "".join(lines)
 
 
 if __name__ == "__main__":
@@ -9,6 +9,7 @@ import sys
 import warnings
 from typing import List
 
+import faiss
 from langchain.retrievers import ContextualCompressionRetriever, EnsembleRetriever
 from langchain.retrievers.document_compressors import CrossEncoderReranker
 from langchain_community.cross_encoders import HuggingFaceCrossEncoder
@@ -49,6 +50,11 @@ def load_faiss_index() -> FAISS:
             embeddings_model,
             allow_dangerous_deserialization=True,
         )
+        # 量化的 IVF 索引（IVF-PQ / IVF-SQ8）按当前配置设置查询时探查的簇数
+        ivf_index = faiss.try_extract_index_ivf(vector_store.index)
+        if ivf_index is not None:
+            ivf_index.nprobe = settings.FAISS_NPROBE
+            logger.info(f"FAISS IVF index loaded with nprobe={settings.FAISS_NPROBE}")
     except Exception as e:
         logger.exception("Failed to load FAISS index.")
         raise e
@@ -132,6 +138,7 @@ def save_cross_encoder_reranker(
         cross_encoder_reranker: The reranker object to save.
     """
     try:
+        # BM25 检索器只以索引目录路径写入 pickle，服务加载 reranker 时再从该目录 mmap 打开
         with open(settings.CROSS_ENCODER_RERANKER_PATH, "wb") as file:
             pickle.dump(cross_encoder_reranker, file)
         logger.info("Successfully saved the cross encoder reranker.")
@@ -0,0 +1,83 @@
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from src.recommender import check_topic_node
+from src.recommender.check_topic_node import GradeTopic, _keyword_classify, batch_classify, topic_classifier
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "what is my IP address",
+        "list all participants of the meeting",
+        "which coating should I use for my deck",
+    ],
+)
+def test_ascii_keywords_do_not_match_inside_words(query):
+    assert _keyword_classify(query) is None
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "recommend a summer dress",
+        "any DRESSES for a wedding?",
+        "I need new shirts",
+        "推荐dress",
+        "有没有适合夏天穿的裙子",
+        "T恤推荐",
+    ],
+)
+def test_fashion_queries_take_fast_path(query):
+    assert _keyword_classify(query) == "Yes"
+
+
+def test_negative_keywords():
+    assert _keyword_classify("今天天气怎么样？") == "No"
+    assert _keyword_classify("tell me some jokes") == "No"
+
+
+def test_mixed_keywords_defer_to_llm():
+    assert _keyword_classify("what dress fits this weather") is None
+
+
+class _FakeGraderLLM:
+    def __init__(self, label="Yes"):
+        self.label = label
+        self.queries = []
+
+    def _grade(self, prompt_value):
+        query = prompt_value.to_messages()[-1].content.removeprefix("User query: ")
+        self.queries.append(query)
+        return GradeTopic(score=self.label)
+
+    def with_structured_output(self, schema):
+        return RunnableLambda(self._grade)
+
+
+@pytest.fixture
+def grader(monkeypatch):
+    fake = _FakeGraderLLM()
+    monkeypatch.setattr(check_topic_node, "get_llm", lambda provider=None: fake)
+    monkeypatch.setattr(check_topic_node, "_TOPIC_CACHE", type(check_topic_node._TOPIC_CACHE)())
+    return fake
+
+
+def test_batch_classify_sends_only_undecided_queries_to_llm(grader):
+    queries = ["推荐一条裙子", "今天天气怎么样？", "something for a gala", "something for a gala"]
+
+    assert batch_classify(queries) == ["Yes", "No", "Yes", "Yes"]
+    assert grader.queries == ["something for a gala"]
+
+
+def test_batch_classify_shares_labels_with_topic_classifier(grader):
+    grader.label = "No"
+    assert topic_classifier({"query": "gift ideas for my mom"})["on_topic"] == "No"
+
+    grader.label = "Yes"
+    assert batch_classify(["gift ideas for my mom"]) == ["No"]
+    assert grader.queries == ["gift ideas for my mom"]
+
+    assert batch_classify(["a look for the office"]) == ["Yes"]
+    assert topic_classifier({"query": "a look for the office"})["on_topic"] == "Yes"
+    assert grader.queries == ["gift ideas for my mom", "a look for the office"]
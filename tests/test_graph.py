@@ -0,0 +1,75 @@
+from langgraph.graph import END, StateGraph
+
+from src.config import settings
+from src.recommender import graph, self_query_node
+from src.recommender.graph import recommend_batch, warmup
+from src.recommender.state import RecState, initial_state
+
+
+class _RecordingApp:
+    def __init__(self):
+        self.states = None
+        self.config = None
+
+    def batch(self, states, config=None):
+        self.states = states
+        self.config = config
+        return states
+
+
+def test_recommend_batch_seeds_full_initial_state():
+    app = _RecordingApp()
+    recommend_batch(app, ["红色连衣裙", "牛仔裤"])
+
+    assert app.states == [initial_state("红色连衣裙"), initial_state("牛仔裤")]
+    assert app.states[0]["docs"] is not app.states[1]["docs"]
+    assert app.config == {"max_concurrency": settings.LLM_BATCH_MAX_CONCURRENCY}
+
+
+def test_recommend_batch_states_satisfy_graph_edges():
+    # 与推荐图相同的读取方式：条件边取 len(state["docs"])，ranker 节点读写 ranker_attempted
+    def ranker(state):
+        state["docs"].append("doc")
+        state["ranker_attempted"] = True
+        return state
+
+    workflow = StateGraph(RecState)
+    workflow.add_node("rag", lambda state: state)
+    workflow.add_node("ranker", ranker)
+    workflow.set_entry_point("rag")
+    workflow.add_conditional_edges(
+        "rag",
+        lambda state: "continue" if len(state["docs"]) < settings.TOTAL_TOP_K and not state["ranker_attempted"] else "end",
+        {"continue": "ranker", "end": END},
+    )
+    workflow.add_edge("ranker", "rag")
+
+    results = recommend_batch(workflow.compile(), ["裙子", "外套"])
+
+    assert [result["query"] for result in results] == ["裙子", "外套"]
+    assert all(result["ranker_attempted"] and result["docs"] == ["doc"] for result in results)
+
+
+def test_warmup_loads_every_local_component(monkeypatch):
+    calls = []
+
+    class _Embeddings:
+        def embed_query(self, text):
+            calls.append("embed")
+
+    class _Chroma:
+        def similarity_search(self, query, k):
+            calls.append("chroma")
+
+    def failing_ranker(query):
+        calls.append("ranker")
+        raise RuntimeError("missing pickle")
+
+    monkeypatch.setattr(self_query_node, "initialize_embeddings_model", lambda: _Embeddings())
+    monkeypatch.setattr(self_query_node, "load_chroma_index", lambda embeddings: _Chroma())
+    monkeypatch.setattr(self_query_node, "build_self_query_chain", lambda vectorstore: calls.append("self_query"))
+    monkeypatch.setattr(graph, "build_ranker", failing_ranker)
+
+    warmup()
+
+    assert calls == ["embed", "chroma", "self_query", "ranker"]
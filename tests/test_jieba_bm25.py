@@ -0,0 +1,65 @@
+import pickle
+import shutil
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from src.config import settings
+from src.indexing.jieba_bm25 import (
+    JiebaBM25LangChainRetriever,
+    create_jieba_bm25_index,
+    load_jieba_bm25_index,
+    save_jieba_bm25_index,
+)
+
+_DOCS = [
+    Document(id="1", page_content="EUSU 冰丝垂感直筒裤子 宽松阔腿长裤"),
+    Document(id="2", page_content="Nike 复古字母印花短袖 T恤 女款"),
+    Document(id="3", page_content="lululemon 无袖连衣裙 纯色修身"),
+]
+
+
+@pytest.fixture
+def index_dir(tmp_path):
+    path = str(tmp_path / "bm25_index")
+    save_jieba_bm25_index(create_jieba_bm25_index(_DOCS), path)
+    return path
+
+
+def _is_memory_mapped(array):
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+
+def _ids(retriever, query):
+    return [doc.id for doc in retriever.invoke(query)]
+
+
+def test_directory_index_pickles_as_a_path(index_dir):
+    # cross_encoder_reranker.pkl 内嵌 BM25 检索器：pickle 中只应有目录路径，反序列化后仍走 mmap
+    retriever = JiebaBM25LangChainRetriever(load_jieba_bm25_index(index_dir))
+    payload = pickle.dumps(retriever)
+    restored = pickle.loads(payload)
+
+    assert "连衣裙".encode("utf-8") not in payload
+    assert _is_memory_mapped(restored._jieba_bm25.term_doc_matrix.data)
+    assert _ids(restored, "连衣裙") == _ids(retriever, "连衣裙") == ["3"]
+
+
+def test_relocated_index_falls_back_to_configured_path(index_dir, tmp_path, monkeypatch):
+    payload = pickle.dumps(JiebaBM25LangChainRetriever(load_jieba_bm25_index(index_dir)))
+    moved = str(tmp_path / "moved_bm25_index")
+    shutil.move(index_dir, moved)
+    monkeypatch.setattr(settings, "BM25_INDEX_PATH", moved)
+
+    assert _ids(pickle.loads(payload), "直筒裤子") == ["1"]
+
+
+def test_in_memory_index_still_pickles_whole():
+    retriever = JiebaBM25LangChainRetriever(create_jieba_bm25_index(_DOCS))
+
+    assert _ids(pickle.loads(pickle.dumps(retriever)), "T恤") == ["2"]
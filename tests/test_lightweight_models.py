@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip("langchain_huggingface")
+
+from src.config import settings
+from src.recommender import lightweight_models
+from src.recommender.lightweight_models import get_lightweight_embeddings, lightweight_embeddings_model_path
+
+
+class _RecordingEmbeddings:
+    def __init__(self, model_name, **kwargs):
+        self.model_name = model_name
+        self.kwargs = kwargs
+
+
+def test_same_model_shares_the_embeddings_snapshot(monkeypatch):
+    monkeypatch.setattr(settings, "LIGHTWEIGHT_EMBEDDINGS_MODEL", settings.EMBEDDINGS_MODEL_NAME)
+    assert lightweight_embeddings_model_path() == settings.EMBEDDINGS_MODEL_PATH
+
+    monkeypatch.setattr(settings, "LIGHTWEIGHT_EMBEDDINGS_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+    assert lightweight_embeddings_model_path() == settings.LIGHTWEIGHT_EMBEDDINGS_MODEL_PATH
+
+
+def test_onnx_backend_loads_the_local_snapshot(monkeypatch, tmp_path):
+    (tmp_path / "config.json").write_text("{}")
+    monkeypatch.setattr(settings, "LIGHTWEIGHT_EMBEDDINGS_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+    monkeypatch.setattr(settings, "LIGHTWEIGHT_EMBEDDINGS_MODEL_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "LIGHTWEIGHT_EMBEDDINGS_BACKEND", "onnx")
+    monkeypatch.setattr(lightweight_models, "HuggingFaceEmbeddings", _RecordingEmbeddings)
+
+    embeddings = get_lightweight_embeddings()
+
+    assert embeddings.model_name == str(tmp_path)
+    assert embeddings.kwargs["model_kwargs"]["backend"] == "onnx"
+
+
+def test_missing_snapshot_falls_back_to_hub_id(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "LIGHTWEIGHT_EMBEDDINGS_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+    monkeypatch.setattr(settings, "LIGHTWEIGHT_EMBEDDINGS_MODEL_PATH", str(tmp_path / "missing"))
+    monkeypatch.setattr(lightweight_models, "HuggingFaceEmbeddings", _RecordingEmbeddings)
+
+    assert get_lightweight_embeddings().model_name == "sentence-transformers/all-MiniLM-L6-v2"
@@ -0,0 +1,27 @@
+from langchain.globals import get_llm_cache, set_llm_cache
+from langchain_community.cache import SQLiteCache
+
+from src.config import settings
+from src.recommender import llm_factory
+
+
+def test_importing_rag_node_does_not_set_up_llm_cache():
+    import src.recommender.rag_node  # noqa: F401
+
+    assert get_llm_cache() is None
+
+
+def test_init_llm_cache_runs_once(monkeypatch, tmp_path):
+    monkeypatch.setattr(llm_factory, "_cache_initialized", False)
+    monkeypatch.setattr(settings, "REDIS_URL", "")
+    monkeypatch.setattr(settings, "LLM_CACHE_DB", str(tmp_path / "llm_cache.db"))
+    try:
+        llm_factory.init_llm_cache()
+        cache = get_llm_cache()
+        llm_factory.init_llm_cache()
+
+        assert isinstance(cache, SQLiteCache)
+        assert get_llm_cache() is cache
+        assert (tmp_path / "llm_cache.db").exists()
+    finally:
+        set_llm_cache(None)
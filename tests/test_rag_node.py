@@ -0,0 +1,165 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_core.documents import Document
+
+from src.config import settings
+from src.recommender import rag_node
+from src.recommender.rag_node import BatchedRagExecutor, arag_recommender, rag_recommender, rag_recommender_batch
+
+
+class _FakeChain:
+    def __init__(self):
+        self.batches = []
+        self.calls = 0
+
+    def invoke(self, chain_input):
+        self.calls += 1
+        return f"rec:{chain_input['query']}"
+
+    async def ainvoke(self, chain_input):
+        return self.invoke(chain_input)
+
+    def batch(self, inputs, config=None, return_exceptions=False):
+        self.batches.append(list(inputs))
+        self.calls += len(inputs)
+        return [ValueError("boom") if i["query"] == "bad" else f"rec:{i['query']}" for i in inputs]
+
+    async def abatch(self, inputs, config=None, return_exceptions=False):
+        self.batches.append(list(inputs))
+        return [ValueError("boom") if i["query"] == "bad" else f"rec:{i['query']}" for i in inputs]
+
+
+@pytest.fixture
+def chain(monkeypatch):
+    fake = _FakeChain()
+    monkeypatch.setattr(rag_node, "build_rag_chain", lambda: fake)
+    return fake
+
+
+@pytest.fixture(autouse=True)
+def _empty_response_cache():
+    rag_node._RESPONSE_CACHE.clear()
+    yield
+    rag_node._RESPONSE_CACHE.clear()
+
+
+def _state(query):
+    doc = Document(
+        id="p1",
+        page_content="长裙",
+        metadata={"productName": "长裙", "price": 99, "sizes_csv": "S, M", "first_color": "红"},
+    )
+    return {"query": query, "docs": [doc], "ranker_attempted": True}
+
+
+def test_entry_points_share_the_response_cache(chain, monkeypatch):
+    monkeypatch.setattr(settings, "RAG_BATCHING_ENABLED", False)
+
+    assert rag_recommender(_state("长裙"))["recommendation"] == "rec:长裙"
+    assert asyncio.run(arag_recommender(_state("长裙")))["recommendation"] == "rec:长裙"
+    assert rag_recommender_batch([_state("长裙")])[0]["recommendation"] == "rec:长裙"
+    assert chain.calls == 1
+
+
+def test_batch_entry_point_reports_errors_per_state(chain):
+    ok, bad = rag_recommender_batch([_state("ok"), _state("bad")])
+
+    assert ok["recommendation"] == "rec:ok"
+    assert "boom" in bad["recommendation"]
+    assert len(rag_node._RESPONSE_CACHE) == 1
+
+
+def test_concurrent_submits_share_one_batch(chain):
+    executor = BatchedRagExecutor(batch_window_ms=10, max_batch=8)
+
+    async def main():
+        return await asyncio.gather(*(executor.submit({"query": q}) for q in ("a", "b", "c")))
+
+    assert asyncio.run(main()) == ["rec:a", "rec:b", "rec:c"]
+    assert len(chain.batches) == 1
+
+
+def test_batch_exceptions_reach_only_their_caller(chain):
+    executor = BatchedRagExecutor(batch_window_ms=10, max_batch=8)
+
+    async def main():
+        return await asyncio.gather(
+            executor.submit({"query": "ok"}), executor.submit({"query": "bad"}), return_exceptions=True
+        )
+
+    ok, bad = asyncio.run(main())
+    assert ok == "rec:ok"
+    assert isinstance(bad, ValueError)
+
+
+def test_executor_survives_a_new_event_loop(chain):
+    # 第一个 asyncio.run 结束后其事件循环关闭，worker 与队列不能被下一个循环复用
+    executor = BatchedRagExecutor(batch_window_ms=1, max_batch=8)
+
+    assert asyncio.run(executor.submit({"query": "first"})) == "rec:first"
+    assert asyncio.run(executor.submit({"query": "second"})) == "rec:second"
+    assert len(executor._workers) == 1
+
+
+def test_concurrent_event_loops_get_their_own_worker(chain):
+    # 第一个循环的 worker 仍在收集窗口内时，第二个线程的循环提交请求，不能落入前者的队列
+    executor = BatchedRagExecutor(batch_window_ms=200, max_batch=8)
+    first_queued = threading.Event()
+
+    async def first():
+        task = asyncio.ensure_future(executor.submit({"query": "x"}))
+        await asyncio.sleep(0.01)
+        first_queued.set()
+        return await task
+
+    async def second():
+        first_queued.wait()
+        return await asyncio.wait_for(executor.submit({"query": "y"}), timeout=2)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        results = [f.result() for f in (pool.submit(asyncio.run, first()), pool.submit(asyncio.run, second()))]
+
+    assert results == ["rec:x", "rec:y"]
+    assert sorted([i["query"] for i in batch] for batch in chain.batches) == [["x"], ["y"]]
+
+
+class _FakeSemanticCache:
+    def __init__(self, hit=None, fail=False):
+        self.hit = hit
+        self.fail = fail
+        self.lookups = []
+        self.updates = []
+
+    def lookup(self, key):
+        self.lookups.append(key)
+        if self.fail:
+            raise ConnectionError("redis down")
+        return self.hit
+
+    def update(self, key, recommendation):
+        self.updates.append((key, recommendation))
+
+
+def test_semantic_hit_skips_the_llm_and_fills_the_lru(chain, monkeypatch):
+    semantic = _FakeSemanticCache(hit="cached rec")
+    monkeypatch.setattr(rag_node, "_get_semantic_cache", lambda: semantic)
+
+    assert rag_recommender(_state(" 长裙 "))["recommendation"] == "cached rec"
+    assert rag_recommender(_state("长裙"))["recommendation"] == "cached rec"
+    assert chain.calls == 0
+    assert len(semantic.lookups) == 1
+    assert semantic.lookups[0].query == "长裙"
+
+
+def test_semantic_miss_stores_the_generated_answer(chain, monkeypatch):
+    semantic = _FakeSemanticCache(fail=True)
+    monkeypatch.setattr(rag_node, "_get_semantic_cache", lambda: semantic)
+
+    assert rag_recommender(_state("长裙"))["recommendation"] == "rec:长裙"
+    assert chain.calls == 1
+    (key, recommendation), = semantic.updates
+    assert key == rag_node._response_cache_key("长裙", _state("长裙")["docs"])
+    assert recommendation == "rec:长裙"
@@ -0,0 +1,43 @@
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.runnables import RunnableLambda
+from langchain_core.structured_query import Comparator, Comparison, StructuredQuery
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from src.recommender.self_query_node import CategoryFilteredSelfQueryRetriever
+from src.recommender.utils import CustomChromaTranslator, category_flag_key
+
+
+def _retriever(**kwargs):
+    return CategoryFilteredSelfQueryRetriever(
+        query_constructor=RunnableLambda(lambda _: None),
+        vectorstore=InMemoryVectorStore(DeterministicFakeEmbedding(size=8)),
+        structured_query_translator=CustomChromaTranslator(),
+        search_kwargs={"k": 3},
+        **kwargs,
+    )
+
+
+def test_category_filter_used_alone():
+    retriever = _retriever(category_filter={category_flag_key("裙"): True})
+    _, search_kwargs = retriever._prepare_query("红色裙子", StructuredQuery(query="红色裙子", filter=None))
+    assert search_kwargs == {"k": 3, "filter": {"category_裙": True}}
+    assert "where_document" not in search_kwargs
+
+
+def test_category_filter_is_anded_with_structured_filter():
+    retriever = _retriever().model_copy(update={"category_filter": {category_flag_key("裤"): True}})
+    structured = StructuredQuery(
+        query="便宜的裤子",
+        filter=Comparison(comparator=Comparator.LT, attribute="price", value=100),
+    )
+    _, search_kwargs = retriever._prepare_query("便宜的裤子", structured)
+    assert search_kwargs["filter"] == {"$and": [{"price": {"$lt": 100}}, {"category_裤": True}]}
+
+
+def test_no_category_keeps_structured_filter():
+    structured = StructuredQuery(
+        query="便宜的",
+        filter=Comparison(comparator=Comparator.LT, attribute="price", value=100),
+    )
+    _, search_kwargs = _retriever()._prepare_query("便宜的", structured)
+    assert search_kwargs["filter"] == {"price": {"$lt": 100}}
@@ -0,0 +1,93 @@
+import pytest
+import requests
+from tenacity import wait_none
+
+from src.recommender import utils
+
+
+class _Response:
+    def __init__(self, status_code=200, content=b'{"data": {"id": 1}}'):
+        self.status_code = status_code
+        self.content = content
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error", response=self)
+
+
+class _Session:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def get(self, url, timeout=None):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture(autouse=True)
+def _no_backoff(monkeypatch):
+    monkeypatch.setattr(utils._fetch_product_detail.retry, "wait", wait_none())
+
+
+def test_fetch_retries_connection_errors_and_5xx():
+    session = _Session(requests.ConnectionError("reset"), _Response(503), _Response())
+    assert utils._fetch_product_detail(session, "url") == {"data": {"id": 1}}
+    assert session.calls == 3
+
+
+def test_fetch_does_not_retry_4xx():
+    session = _Session(_Response(404), _Response())
+    assert utils._fetch_product_detail_or_none(session, "url") is None
+    assert session.calls == 1
+
+
+def test_fetch_skips_non_json_body():
+    session = _Session(_Response(content=b"<html>maintenance</html>"))
+    assert utils._fetch_product_detail_or_none(session, "url") is None
+    assert session.calls == 1
+
+
+def test_get_product_details_keeps_successful_items(monkeypatch, tmp_path):
+    class _PartialSession(_Session):
+        def get(self, url, timeout=None):
+            if url.endswith("/3"):
+                return _Response(content=b"not json")
+            return _Response(content=b'{"data": {"id": %s}}' % url.rsplit("/", 1)[1].encode())
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+    monkeypatch.setattr(requests, "Session", _PartialSession)
+    monkeypatch.setattr(utils.settings, "PROCESSED_DATA_PATH", str(tmp_path / "products.json"))
+
+    database = utils.get_product_details()
+
+    assert [item["id"] for item in database] == [i for i in range(1, 13) if i != 3]
+    assert (tmp_path / "products.json").exists()
+
+
+def test_extract_details_reflects_changed_documents():
+    from langchain_core.documents import Document
+
+    doc = Document(page_content='{"Product Details": "红色 长裙"}')
+    assert utils.extract_details_from_doc(doc) == "红色 长裙"
+
+    copied = doc.model_copy(update={"page_content": '{"Product Details": "蓝色 衬衫"}'})
+    assert utils.extract_details_from_doc(copied) == "蓝色 衬衫"
+
+    doc.metadata["Product Details"] = "黑色 外套"
+    assert utils.extract_details_from_doc(doc) == "黑色 外套"
+    assert "_cached_details" not in doc.__dict__
+
+
+def test_extract_details_falls_back_to_raw_page_content():
+    from langchain_core.documents import Document
+
+    assert utils.extract_details_from_doc(Document(page_content="纯文本描述")) == "纯文本描述"